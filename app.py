@@ -1,14 +1,20 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 
 # Import functions from the new modules
 from state_helpers import initialize_session_state
 from ui_controls import (
     display_file_uploader, 
     display_filter_controls_in_main, 
-    display_save_load_filter_sets_controls
+    display_export_controls,
+    display_result_grid,
+    display_save_load_filter_sets_controls,
+    run_streamed_filters
 )
 from filter_processing import apply_filters_to_dataframe
+from filter_plan import canonical_filters_json
+from filter_planner import plan_report_frame
 
 # Initialize session state ONCE at the very beginning
 initialize_session_state() # Sua função existente para inicializar o estado da app
@@ -80,17 +86,63 @@ def main_page():
 
     if current_df is not None and not current_df.empty:
         active_filters = st.session_state.get('filters', [])
-        df_filtered = apply_filters_to_dataframe(current_df, active_filters)
+        plan_report = []
+        stream_source = st.session_state.get('stream_source')
+        if stream_source is not None:
+            st.info(f"📡 **Dataset em streaming:** `{stream_source['name']}` — o arquivo é lido em blocos "
+                    "a cada filtragem; os controles usam as primeiras linhas como amostra.")
+            stream_result = run_streamed_filters(stream_source, active_filters)
+            # Only the (bounded) matched rows are in memory: the grid pages over them
+            grid_df = stream_result['df']
+            grid_positions = np.arange(len(grid_df))
+            original_rows, filtered_rows = stream_result['total_rows'], stream_result['matched_rows']
+        else:
+            grid_df = current_df
+            grid_positions = apply_filters_to_dataframe(current_df, active_filters, output='indices',
+                                                        report=plan_report)
+            original_rows, filtered_rows = len(current_df), len(grid_positions)
 
         st.subheader("📊 Visualização dos Dados")
-        st.dataframe(df_filtered, height=300) 
-        st.markdown(f"**Resumo:** Original: `{len(current_df)}` linhas | Filtrado: `{len(df_filtered)}` linhas")
+        display_order, shown_columns = display_result_grid(grid_df, grid_positions, active_filters)
+        with st.expander("📥 Exportar Dados Filtrados", expanded=False):
+            st.caption("Exporta as linhas filtradas na ordem e com as colunas exibidas acima, "
+                       "gravadas em blocos para limitar o uso de memória.")
+            result_key = (canonical_filters_json(active_filters), st.session_state.get('grid_sort_column'),
+                          st.session_state.get('grid_sort_desc'))
+            display_export_controls(grid_df, display_order, result_key,
+                                    key="main_results", file_stem="dados_filtrados", columns=shown_columns)
+        summary = f"**Resumo:** Original: `{original_rows}` linhas | Filtrado: `{filtered_rows}` linhas"
+        load_info = st.session_state.get('load_info')
+        if load_info and 'preview_rows' in load_info:
+            summary += " | ⏳ Prévia: primeiras linhas do arquivo, o restante está sendo carregado"
+        elif load_info:
+            summary += (f" | Carregado em `{load_info['seconds']:.2f}s` ({load_info['engine']})"
+                        f" | Pico de memória: `{load_info['peak_bytes'] / 1024**2:.1f} MB`")
+            if 'memory_after' in load_info:
+                summary += (f" | Memória: `{load_info['memory_before'] / 1024**2:.1f} MB` → "
+                            f"`{load_info['memory_after'] / 1024**2:.1f} MB`")
+            if 'catalog_seconds' in load_info:
+                summary += f" | Catálogo de colunas: `{load_info['catalog_seconds']:.2f}s`"
+        st.markdown(summary)
+        if load_info and 'per_file' in load_info:
+            per_file = " | ".join(f"{name}: {seconds:.2f}s ({engine})"
+                                  for name, (seconds, engine) in load_info['per_file'].items())
+            st.caption(f"Arquivos combinados — {per_file} | Soma dos tempos: {load_info['serial_seconds']:.2f}s")
+            for name, columns in load_info['schema']['missing_columns'].items():
+                st.caption(f"⚠️ `{name}` não tem as colunas: {', '.join(map(str, columns))} (valores vazios).")
+        if stream_source is not None and stream_result['truncated']:
+            st.caption(f"Exibindo as primeiras {len(grid_df)} linhas filtradas.")
 
         display_filter_controls_in_main(list(current_df.columns))
 
         if active_filters:
             with st.expander("Ver Definição JSON dos Filtros Ativos", expanded=False):
                 st.json(active_filters) 
+        if plan_report: # only filled by the in-memory engine
+            with st.expander("Ver Plano de Execução dos Filtros", expanded=False):
+                st.caption("Ordem escolhida pelo planejador (filtros mais seletivos e baratos primeiro), "
+                           "com as linhas estimadas e as linhas restantes após cada filtro.")
+                st.dataframe(plan_report_frame(plan_report), use_container_width=True, hide_index=True)
     else:
         st.info("✨ Bem-vindo! Carregue um arquivo (XLSX, CSV, ODS) para começar.")
 
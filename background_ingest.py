@@ -0,0 +1,108 @@
+"""Parsing of large uploads on a background worker.
+
+The session gets a preview (the first PREVIEW_ROWS rows, read synchronously,
+which only takes a fraction of the full parse) while the complete file is parsed
+on a worker thread. The UI polls the IngestJob for progress and swaps the
+full dataset in when it is done; filters configured on the preview carry over.
+A job that is superseded (another upload, the file removed) is cancelled: the
+file then reads as ended, so the parse stops early, freeing the worker and the
+copy of the upload.
+"""
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Rows shown (and filterable) while the full file is being parsed
+PREVIEW_ROWS = 5000
+# Smaller uploads parse quickly enough to be loaded in the script run directly
+BACKGROUND_MIN_BYTES = 5 * 1024 * 1024
+
+_ingest_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ingest-bg")
+
+
+class IngestCancelled(Exception):
+    """Raised inside a background parse whose job was cancelled."""
+
+
+class ProgressFile(io.BytesIO):
+    """In-memory copy of an upload that counts the bytes parsers read from it,
+    so a worker can parse it while the session keeps using the original.
+
+    After cancel(), reads return no data. (Raising from a read instead would
+    leave pyarrow's threaded CSV reader unable to read any further file.)
+    Parsers of zipped workbooks then fail on the truncated archive; a CSV
+    parse may end normally, so check raise_if_cancelled() before using it.
+    """
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+        self.bytes_read = 0
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise IngestCancelled(self.name)
+
+    def read(self, size=-1):
+        if self.cancelled:
+            return b''
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def read1(self, size=-1):
+        if self.cancelled:
+            return b''
+        data = super().read1(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        if self.cancelled:
+            return 0
+        n = super().readinto(buffer)
+        self.bytes_read += n
+        return n
+
+    @property
+    def fraction(self):
+        # Parsers may read parts of the file twice (format sniffing, zip
+        # directory): this is an estimate, never shown as complete before the end.
+        return min(self.bytes_read / self.size, 0.99) if self.size else 0.0
+
+
+class IngestJob:
+    """A background load: load() -> (DataFrame, load_info) runs on the pool."""
+
+    def __init__(self, name, load, progress_file):
+        self.name = name
+        self.progress_file = progress_file
+        self.started = time.perf_counter()
+        self._future = _ingest_pool.submit(load)
+
+    def cancel(self):
+        """Drops a job nobody will read: a queued job never starts, a running
+        one stops early (see ProgressFile). No effect once done."""
+        if not self._future.cancel():
+            self.progress_file.cancel()
+
+    @property
+    def done(self):
+        return self._future.done()
+
+    @property
+    def progress(self):
+        return 1.0 if self.done else self.progress_file.fraction
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def result(self):
+        """(DataFrame, load_info); raises the parse error, if any."""
+        return self._future.result()
@@ -0,0 +1,386 @@
+"""Loading of data files, including out-of-core (streamed) CSV filtering.
+
+CSV uploads are parsed with the multithreaded Arrow CSV reader (read_csv_fast),
+with the separator, decimal mark and encoding of Brazilian-locale exports
+detected from a sample; pandas is the fallback.
+
+Streaming mode never holds a whole CSV in memory: the file is read in chunks of
+STREAM_CHUNK_ROWS rows, each chunk goes through the filter engine, and only the
+matching rows (or only the counts, for the analysis page) are kept. Memory use
+is bounded by the chunk size plus the kept result.
+"""
+import codecs
+import csv
+import io
+import os
+import re
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from filter_plan import get_filter_plan
+from filter_processing import count_filter_sets, evaluate_filter_plan
+
+STREAM_CHUNK_ROWS = 200_000
+# Upper bound on matching rows kept in memory by stream_filter_csv
+STREAM_MAX_RESULT_ROWS = 1_000_000
+# Optional server-side folder with CSVs too large to upload through the browser
+STREAM_DATA_DIR = os.environ.get("STREAM_DATA_DIR", "")
+
+
+# Bytes read from the start of a CSV to detect its format and column types
+CSV_SAMPLE_BYTES = 1024 * 1024
+# Settings of read_csv_fast that change its result for the same bytes (ingest cache key)
+CSV_READ_OPTIONS = {'reader': 'read_csv_fast', 'sample_bytes': CSV_SAMPLE_BYTES}
+
+# A number written with decimal comma, optionally with '.' thousands: 1.234,56 / -0,5
+_BR_NUMBER = r"-?\d{1,3}(?:\.\d{3})+(?:,\d+)?|-?\d+,\d+"
+_BR_NUMBER_RE = re.compile(rf"^\s*(?:{_BR_NUMBER})\s*$")
+
+
+def _read_sample(file):
+    file.seek(0)
+    sample = file.read(CSV_SAMPLE_BYTES)
+    file.seek(0)
+    return sample
+
+
+def _detect_encoding(sample):
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # Incremental decoding tolerates a character cut at the end of the sample
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        sample.decode('cp1252') # "ANSI" exports of Excel in pt-BR
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def detect_csv_format(sample):
+    """(encoding, separator, decimal mark) of a CSV from its first bytes."""
+    encoding = _detect_encoding(sample)
+    text = sample.decode(encoding, errors='ignore')
+    lines = text.splitlines()[:200]
+    try:
+        sep = csv.Sniffer().sniff("\n".join(lines[:50]), delimiters=",;\t|").delimiter
+    except csv.Error:
+        sep = ','
+    decimal = _detect_decimal_mark(lines[1:], sep) if sep != ',' else '.'
+    return encoding, sep, decimal
+
+
+# Field shapes counted by _detect_decimal_mark. '1.909' or '1.234.567' could be
+# dot decimals or BR thousands and counts for neither mark.
+_COMMA_DECIMAL_RE = re.compile(r"-?(?:\d{1,3}(?:\.\d{3})+|\d+),\d+")
+_DOT_DECIMAL_RE = re.compile(r"-?\d+\.\d+")
+_DOT_THOUSANDS_RE = re.compile(r"-?\d{1,3}(?:\.\d{3})+")
+_SHORT_DOT_DECIMAL_RE = re.compile(r"-?\d+\.\d{1,2}")
+
+
+def _detect_decimal_mark(lines, sep):
+    """',' when the numeric-looking fields of the sample clearly use a decimal
+    comma: comma decimals outnumber dot decimals by more than 2 to 1, and no
+    column with comma decimals also has values like '1.85'. '.' otherwise."""
+    comma_counts, dot_counts, short_dot_columns = {}, {}, set()
+    for row in csv.reader(lines, delimiter=sep):
+        for column, field in enumerate(row):
+            field = field.strip()
+            if _COMMA_DECIMAL_RE.fullmatch(field):
+                comma_counts[column] = comma_counts.get(column, 0) + 1
+            elif _DOT_DECIMAL_RE.fullmatch(field) and not _DOT_THOUSANDS_RE.fullmatch(field):
+                dot_counts[column] = dot_counts.get(column, 0) + 1
+                if _SHORT_DOT_DECIMAL_RE.fullmatch(field):
+                    short_dot_columns.add(column)
+    comma_total, dot_total = sum(comma_counts.values()), sum(dot_counts.values())
+    if comma_total == 0 or comma_total <= 2 * dot_total or short_dot_columns & comma_counts.keys():
+        return '.'
+    return ','
+
+
+def _sampled_column_types(sample, read_options, parse_options, convert_options):
+    """Column types inferred by Arrow on the sample rows, or None if the sample
+    cannot be parsed on its own (e.g. it ends inside a quoted field).
+
+    Date/time columns are kept as text, as pandas does, so that the filters
+    behave the same whichever reader loaded the file; all-empty columns in the
+    sample are read as text too, in case later rows have values.
+    """
+    cut = sample.rfind(b"\n")
+    if cut <= 0:
+        return None
+    try:
+        schema = pa_csv.read_csv(io.BytesIO(sample[:cut + 1]), read_options=read_options,
+                                 parse_options=parse_options, convert_options=convert_options).schema
+    except (pa.ArrowInvalid, UnicodeDecodeError):
+        return None
+    types = {}
+    for field in schema:
+        t = field.type
+        if pa.types.is_temporal(t) or pa.types.is_null(t):
+            t = pa.string()
+        types[field.name] = t
+    return types
+
+
+def _convert_br_numbers(df):
+    # Arrow parses '1234,5' with decimal_point=',' but not '1.234,5'; columns
+    # whose every value is such a number are converted here.
+    for col in df.columns:
+        series = df[col]
+        if series.dtype != object:
+            continue
+        values = series.dropna()
+        if values.empty or not values.head(1000).map(lambda v: isinstance(v, str) and bool(_BR_NUMBER_RE.match(v))).all():
+            continue
+        text = values.astype(str)
+        if not text.str.fullmatch(rf"\s*(?:{_BR_NUMBER}|-?\d+)\s*").all():
+            continue
+        numbers = pd.to_numeric(text.str.strip().str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+        df[col] = numbers.reindex(series.index)
+    return df
+
+
+def _read_csv_arrow(file, sample, encoding, sep, decimal, info):
+    read_options = pa_csv.ReadOptions(encoding=encoding.replace('utf-8-sig', 'utf-8'), use_threads=True)
+    parse_options = pa_csv.ParseOptions(delimiter=sep)
+    convert_options = pa_csv.ConvertOptions(decimal_point=decimal, strings_can_be_null=True)
+    column_types = _sampled_column_types(sample, read_options, parse_options, convert_options)
+    if column_types:
+        convert_options = pa_csv.ConvertOptions(decimal_point=decimal, strings_can_be_null=True,
+                                                column_types=column_types)
+
+    file.seek(0)
+    table = pa_csv.read_csv(file, read_options=read_options, parse_options=parse_options,
+                            convert_options=convert_options)
+    names = table.column_names
+    if any(not name for name in names) or len(set(names)) != len(names):
+        # pandas names these 'Unnamed: 0' / 'col.1'; let it do so
+        raise ValueError("cabeçalho com colunas vazias ou repetidas")
+    df = table.to_pandas()
+    # The table and the DataFrame coexist during the conversion. (A per-read
+    # proxy memory pool would measure this exactly, but it must outlive every
+    # buffer allocated from it, including those the DataFrame keeps.)
+    info['arrow_peak_bytes'] = table.get_total_buffer_size()
+    del table
+    if decimal == ',':
+        df = _convert_br_numbers(df)
+    return df
+
+
+def read_csv_fast(file, info=None):
+    """Reads a CSV upload with the multithreaded Arrow reader.
+
+    Encoding (UTF-8, with or without BOM, or cp1252), separator and decimal mark
+    are detected from the first CSV_SAMPLE_BYTES, and the column types are
+    inferred once from the sample. If Arrow cannot read the file, pandas is used
+    with the detected format and, failing that, with its defaults.
+
+    Args:
+        file: Binary file-like object (e.g. a Streamlit UploadedFile).
+        info (dict, optional): Receives 'engine', 'encoding', 'sep' and 'decimal'.
+    """
+    info = {} if info is None else info
+    sample = _read_sample(file)
+    encoding, sep, decimal = detect_csv_format(sample)
+    info.update(encoding=encoding, sep=sep, decimal=decimal)
+    try:
+        df = _read_csv_arrow(file, sample, encoding, sep, decimal, info)
+        info['engine'] = 'pyarrow'
+        return df
+    except Exception:
+        pass
+    file.seek(0)
+    try:
+        df = pd.read_csv(file, sep=sep, decimal=decimal, thousands='.' if decimal == ',' else None,
+                         encoding=encoding)
+        info['engine'] = 'pandas'
+    except Exception:
+        file.seek(0)
+        df = pd.read_csv(file)
+        info.update(engine='pandas', encoding='utf-8', sep=',', decimal='.')
+    return df
+
+
+def read_csv_preview(file, nrows):
+    """First nrows rows of a CSV, read with pandas in the detected format."""
+    encoding, sep, decimal = detect_csv_format(_read_sample(file))
+    try:
+        return pd.read_csv(file, nrows=nrows, sep=sep, decimal=decimal,
+                           thousands='.' if decimal == ',' else None, encoding=encoding)
+    finally:
+        file.seek(0)
+
+
+def measure_load(load):
+    """Runs load(info) -> DataFrame, timing it and estimating its peak memory.
+
+    Returns (DataFrame, info) where info has 'seconds' and 'peak_bytes': the
+    size of the resulting DataFrame plus, for the Arrow reader, the peak of the
+    Arrow buffers it allocated (they are alive while the DataFrame is built).
+    Parser-internal buffers of pandas/openpyxl are not counted; tracing every
+    allocation would slow the load down by half.
+    """
+    info = {}
+    started = time.perf_counter()
+    df = load(info)
+    info['seconds'] = time.perf_counter() - started
+    info['peak_bytes'] = int(df.memory_usage(deep=True).sum()) + info.pop('arrow_peak_bytes', 0)
+    return df, info
+
+
+def list_server_csv_files():
+    """CSV files available in STREAM_DATA_DIR (empty when not configured)."""
+    if not STREAM_DATA_DIR or not os.path.isdir(STREAM_DATA_DIR):
+        return []
+    return sorted(f for f in os.listdir(STREAM_DATA_DIR) if f.lower().endswith(".csv"))
+
+
+def make_stream_source(file_or_name, chunksize=STREAM_CHUNK_ROWS):
+    """Describes a streamed CSV: an uploaded file object or a file name in STREAM_DATA_DIR."""
+    if isinstance(file_or_name, str):
+        path = os.path.join(STREAM_DATA_DIR, os.path.basename(file_or_name))
+        return {'name': os.path.basename(file_or_name), 'path': path, 'file': None, 'chunksize': chunksize}
+    return {'name': file_or_name.name, 'path': None, 'file': file_or_name, 'chunksize': chunksize}
+
+
+def _stream_column_types(sample):
+    """(text columns, numeric columns) of a streamed CSV, from its first chunk.
+    Columns with no value in the sample are read as text, as the Arrow reader does."""
+    text_columns, numeric_columns = [], []
+    for column in sample.columns:
+        series = sample[column]
+        if series.isna().all() or pd.api.types.is_object_dtype(series.dtype):
+            text_columns.append(column)
+        elif pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+            numeric_columns.append(column)
+    return text_columns, numeric_columns
+
+
+def iter_csv_chunks(stream_source):
+    """Yields (chunk, fraction of the file read so far), the chunks being
+    DataFrames of at most stream_source['chunksize'] rows. Row labels continue
+    across chunks, as if the whole file had been read at once."""
+    if stream_source['file'] is not None:
+        handle = stream_source['file']
+        handle.seek(0)
+        total_bytes = getattr(handle, 'size', None) or 0
+        close_handle = False
+    else:
+        handle = open(stream_source['path'], 'rb')
+        total_bytes = os.path.getsize(stream_source['path'])
+        close_handle = True
+    try:
+        encoding, sep, decimal = detect_csv_format(_read_sample(handle))
+        read_options = dict(sep=sep, decimal=decimal, thousands='.' if decimal == ',' else None, encoding=encoding)
+        # pandas infers dtypes per chunk: a text column that is blank in one chunk
+        # would come out as float64 there (and a stray text value would make a
+        # numeric column object). Column types are fixed once, from the first chunk.
+        text_columns, numeric_columns = _stream_column_types(
+            pd.read_csv(handle, nrows=stream_source['chunksize'], **read_options))
+        handle.seek(0)
+        with pd.read_csv(handle, chunksize=stream_source['chunksize'],
+                         dtype={column: object for column in text_columns}, **read_options) as reader:
+            for chunk in reader:
+                for column in numeric_columns:
+                    if not pd.api.types.is_numeric_dtype(chunk[column].dtype):
+                        chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+                fraction = min(handle.tell() / total_bytes, 1.0) if total_bytes else 0.0
+                yield chunk, fraction
+    finally:
+        if close_handle:
+            handle.close()
+
+
+def read_stream_sample(stream_source):
+    """First chunk of the CSV; used as st.session_state.df so that the filter
+    controls (column lists, dtypes, ranges) work as for a fully loaded file."""
+    for chunk, _ in iter_csv_chunks(stream_source):
+        return chunk
+    return pd.DataFrame()
+
+
+def _add_unique(messages, new_messages):
+    # Every chunk produces the same warnings for the same filter; show them once
+    for message in new_messages:
+        if message not in messages:
+            messages.append(message)
+
+
+def stream_filter_csv(stream_source, active_filters, messages, progress=None, max_rows=STREAM_MAX_RESULT_ROWS):
+    """Filters a CSV chunk by chunk, keeping only the matching rows.
+
+    Args:
+        stream_source (dict): From make_stream_source.
+        active_filters (list): Filter configs, as for apply_filters_to_dataframe.
+        messages (list): Receives the (level, text) warnings/errors, once each.
+        progress (callable, optional): Called with (rows read so far, fraction of the file read).
+        max_rows (int, optional): Matching rows kept at most; the rest are only counted.
+
+    Returns:
+        dict: 'df' (kept matching rows), 'total_rows', 'matched_rows',
+        'truncated' and 'seconds'.
+    """
+    started = time.perf_counter()
+    kept, kept_rows, matched_rows, total_rows = [], 0, 0, 0
+    plan = None
+    for chunk, fraction in iter_csv_chunks(stream_source):
+        chunk_messages = []
+        if active_filters:
+            if plan is None: # every chunk has the column types of the first one
+                plan = get_filter_plan(chunk, active_filters)
+                chunk_messages.extend(plan.messages)
+            # Chunks are seen once: no index building, bounded-memory fused kernels
+            mask = evaluate_filter_plan(chunk, plan, chunk_messages, use_index=False, backend='fused')
+            matches = chunk[mask] if not mask.all() else chunk
+        else:
+            matches = chunk
+        _add_unique(messages, chunk_messages)
+
+        total_rows += len(chunk)
+        matched_rows += len(matches)
+        if kept_rows < max_rows and len(matches):
+            matches = matches.iloc[:max_rows - kept_rows]
+            kept.append(matches)
+            kept_rows += len(matches)
+        if progress is not None:
+            progress(total_rows, fraction)
+
+    df = pd.concat(kept) if kept else read_stream_sample(stream_source).iloc[0:0]
+    return {
+        'df': df, 'total_rows': total_rows, 'matched_rows': matched_rows,
+        'truncated': matched_rows > kept_rows, 'seconds': time.perf_counter() - started,
+    }
+
+
+def stream_count_filter_sets(stream_source, filter_sets, messages, progress=None, max_workers=1):
+    """Row counts of several named filter sets over a streamed CSV.
+
+    Args:
+        messages (list): Receives the (level, text) warnings/errors, once each.
+        progress (callable, optional): Called with (rows read so far, fraction of the file read).
+
+    Returns:
+        tuple: ({set name: matching rows}, total rows read)
+    """
+    counts = {name: 0 for name in filter_sets}
+    total_rows = 0
+    for chunk, fraction in iter_csv_chunks(stream_source):
+        chunk_messages = []
+        # Chunks are never seen again: keep them out of the shared result cache
+        chunk_counts = count_filter_sets(chunk, filter_sets, use_index=False, messages=chunk_messages,
+                                         max_workers=max_workers, use_cache=False)
+        _add_unique(messages, chunk_messages)
+        for name, count in chunk_counts.items():
+            counts[name] += count
+        total_rows += len(chunk)
+        if progress is not None:
+            progress(total_rows, fraction)
+    return counts, total_rows
+
@@ -0,0 +1,542 @@
+"""Per-dataset caches of derived column data.
+
+Everything here is derived from one loaded DataFrame and stays valid for as long
+as that DataFrame object is in use: the app never modifies a loaded DataFrame in
+place, it only replaces st.session_state.df. Caches are attached to the DataFrame
+object through a weak reference, so they are dropped together with the
+dataset (or explicitly via drop_dataset_cache when it is replaced).
+"""
+import hashlib
+import threading
+import unicodedata
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# Byte budget, per dataset, for the boolean masks of individual filter steps
+# kept between reruns (least recently used masks are evicted first).
+STEP_MASK_CACHE_BYTES = 64 * 1024 * 1024
+
+
+# Integers beyond this magnitude are not all representable in float64
+FLOAT_EXACT_INT = 2**53
+
+
+@dataclass(frozen=True)
+class NumericColumn:
+    """A column coerced with pd.to_numeric(errors='coerce') to float64, except
+    plain integer columns, whose native values are kept (exact beyond 2**53).
+    Both arrays are read-only and shared by every reader of the dataset.
+
+    exact is False when the float64 values round some of the column's integers
+    (nullable integer columns beyond FLOAT_EXACT_INT); comparisons must then
+    use the column itself.
+    """
+    values: np.ndarray
+    nan_mask: np.ndarray
+    exact: bool = True
+
+    @property
+    def valid_count(self):
+        return int(len(self.nan_mask) - np.count_nonzero(self.nan_mask))
+
+
+@dataclass(frozen=True)
+class SortIndex:
+    """Row positions of a numeric column ordered by value (NaNs last).
+
+    Any range predicate on the column maps to one slice of `order`, found with
+    two binary searches on `sorted_values`.
+    """
+    order: np.ndarray
+    sorted_values: np.ndarray
+    valid_count: int
+
+    def bounds_for(self, op, value):
+        """[start, stop) slice of `order` holding the rows where `column <op> value`
+        is True. Returns None for '!=' (not a single slice)."""
+        if op == '!=':
+            return None
+        if np.isnan(value):
+            return 0, 0 # every comparison with NaN is False
+        valid = self.sorted_values[:self.valid_count]
+        value = self._search_key(value)
+        if op == '>':
+            return np.searchsorted(valid, value, side='right'), self.valid_count
+        if op == '>=':
+            return np.searchsorted(valid, value, side='left'), self.valid_count
+        if op == '<':
+            return 0, np.searchsorted(valid, value, side='left')
+        if op == '<=':
+            return 0, np.searchsorted(valid, value, side='right')
+        return np.searchsorted(valid, value, side='left'), np.searchsorted(valid, value, side='right')
+
+    def range_bounds(self, low, high):
+        """[start, stop) slice of `order` holding the rows where low <= column <= high."""
+        if np.isnan(low) or np.isnan(high):
+            return 0, 0
+        valid = self.sorted_values[:self.valid_count]
+        start = np.searchsorted(valid, self._search_key(low), side='left')
+        stop = np.searchsorted(valid, self._search_key(high), side='right')
+        return start, max(start, stop)
+
+    def positions(self, start, stop):
+        """Row positions of the slice, in ascending (original row) order."""
+        return np.sort(self.order[start:stop])
+
+    def _search_key(self, value):
+        # searchsorted compares in float64 unless the key has the column's integer
+        # dtype (e.g. uint64 values and a Python int), rounding beyond 2**53
+        dtype = self.sorted_values.dtype
+        if dtype.kind in 'iu' and isinstance(value, (int, np.integer)):
+            info = np.iinfo(dtype)
+            if info.min <= value <= info.max:
+                return dtype.type(value)
+        return value
+
+
+@dataclass(frozen=True)
+class ValueIndex:
+    """Inverted index of a text/categorical column: distinct value -> row positions.
+
+    Rows are grouped by value code; the rows of code c are
+    grouped_rows[offsets[c]:offsets[c+1]], in ascending row order. Missing
+    values get code -1 and never match.
+    """
+    codes: np.ndarray
+    grouped_rows: np.ndarray
+    offsets: np.ndarray
+    code_of: dict
+
+    def code_for(self, value):
+        try:
+            return self.code_of.get(value)
+        except TypeError: # unhashable filter value matches nothing
+            return None
+
+    def bounds_for_value(self, value):
+        """[start, stop) slice of grouped_rows holding the rows equal to value."""
+        code = self.code_for(value)
+        if code is None:
+            return 0, 0
+        return int(self.offsets[code]), int(self.offsets[code + 1])
+
+    def positions(self, start, stop):
+        """Row positions of the slice (already in ascending row order)."""
+        return self.grouped_rows[start:stop]
+
+
+@dataclass(frozen=True)
+class ColumnStats:
+    """Cheap summary of a numeric column used for selectivity estimates."""
+    n_rows: int
+    valid_count: int
+    distinct_count: int
+    min: float
+    max: float
+    hist_counts: np.ndarray
+    hist_edges: np.ndarray
+
+    def fraction_at_most(self, x):
+        """Estimated fraction of the valid values <= x (histogram, linear within a bin)."""
+        if self.valid_count == 0 or np.isnan(x) or x < self.min:
+            return 0.0
+        if x >= self.max:
+            return 1.0
+        edges, counts = self.hist_edges, self.hist_counts
+        b = min(max(int(np.searchsorted(edges, x, side='right')) - 1, 0), len(counts) - 1)
+        width = edges[b + 1] - edges[b]
+        partial = counts[b] * ((x - edges[b]) / width if width > 0 else 1.0)
+        return float((counts[:b].sum() + partial) / self.valid_count)
+
+
+@dataclass(frozen=True, eq=False)
+class ColumnProfile:
+    """Catalog entry of one column, computed once per dataset.
+
+    kind is 'numeric' (pd.api.types.is_numeric_dtype) or 'text'. Numeric
+    columns carry their ColumnStats (min/max/histogram); text columns carry
+    value_counts, a Series of counts indexed by the distinct values as text,
+    sorted by value, which is what the value pickers offer.
+    """
+    kind: str
+    dtype: str
+    n_rows: int
+    null_count: int
+    distinct_count: int
+    min: float = np.nan
+    max: float = np.nan
+    stats: ColumnStats = None
+    value_counts: pd.Series = None
+
+    @property
+    def is_numeric(self):
+        return self.kind == 'numeric'
+
+    @property
+    def options(self):
+        """Distinct values as text, sorted (empty for numeric columns)."""
+        return [] if self.value_counts is None else self.value_counts.index.tolist()
+
+
+def fold_text(text):
+    """Case- and accent-insensitive form of text used by value searches ('São' -> 'sao')."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+@dataclass(frozen=True, eq=False)
+class ValueSearchIndex:
+    """Distinct values of a text column (as text) for paged value pickers.
+
+    Values are sorted by their folded form, so the values starting with a
+    prefix are one slice found with two binary searches; by_frequency lists
+    them from the most to the least frequent.
+    """
+    values: np.ndarray
+    folded: np.ndarray
+    counts: np.ndarray
+    by_frequency: np.ndarray
+
+    def __len__(self):
+        return len(self.values)
+
+    def page(self, query, start, size):
+        """(values, counts, total) of the values starting with query (ignoring
+        case and accents), sorted by value, or of all the values, most frequent
+        first, when query is empty. Only the [start, start + size) page is
+        returned; total is the number of values matching."""
+        query = fold_text(query or '')
+        if query:
+            low = int(np.searchsorted(self.folded, query, side='left'))
+            high = int(np.searchsorted(self.folded, query + '\U0010ffff', side='left'))
+            positions = np.arange(low + start, min(low + start + size, high))
+            total = high - low
+        else:
+            positions = self.by_frequency[start:start + size]
+            total = len(self.values)
+        return self.values[positions].tolist(), self.counts[positions].tolist(), total
+
+
+class DatasetCache:
+    """Lazily built derived data for one DataFrame."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.numeric_columns = {}
+        self.sort_indexes = {}
+        self.value_indexes = {}
+        self.column_stats = {}
+        self.column_profiles = {}
+        self.value_search_indexes = {}
+        self.value_ranks = {}
+        self.step_masks = OrderedDict()
+        self.step_masks_bytes = 0
+        self.content_hash = None
+
+
+# id(df) -> (weakref to df, DatasetCache). DataFrames are unhashable, so a
+# WeakKeyDictionary cannot be used; the weakref callback removes the entry
+# when the DataFrame is garbage collected.
+_caches = {}
+_caches_lock = threading.RLock() # re-entrant: weakref callbacks may fire during GC inside the lock
+
+
+def _forget(key, ref):
+    with _caches_lock:
+        entry = _caches.get(key)
+        if entry is not None and entry[0] is ref:
+            del _caches[key]
+
+
+def get_dataset_cache(df):
+    key = id(df)
+    with _caches_lock:
+        entry = _caches.get(key)
+        if entry is not None and entry[0]() is df:
+            return entry[1]
+        cache = DatasetCache()
+        ref = weakref.ref(df, lambda r, key=key: _forget(key, r))
+        _caches[key] = (ref, cache)
+        return cache
+
+
+def drop_dataset_cache(df):
+    """Forgets every cached structure derived from df."""
+    if df is None:
+        return
+    with _caches_lock:
+        entry = _caches.get(id(df))
+        if entry is not None and entry[0]() is df:
+            del _caches[id(df)]
+
+
+def _hash_content(df):
+    # Column names, dtypes and every cell value in row order. The index is left
+    # out: cached results are row positions, which do not depend on the labels.
+    digest = hashlib.sha1()
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def get_content_hash(df):
+    """Hash of df's content, computed once per dataset (O(rows x columns)).
+
+    Two DataFrames parsed from the same file in different sessions get the same
+    hash. Returns None when some cells cannot be hashed (e.g. lists).
+    """
+    cache = get_dataset_cache(df)
+    if cache.content_hash is None:
+        try:
+            content_hash = _hash_content(df)
+        except TypeError:
+            content_hash = '' # unhashable cells: remembered so we do not retry
+        with cache.lock:
+            cache.content_hash = content_hash
+    return cache.content_hash or None
+
+
+def _coerce_numeric(series):
+    # For float64 and plain integer columns this is a view on the DataFrame's own
+    # buffer (no copy); the read-only flag only applies to the view we hand out.
+    exact = True
+    if pd.api.types.is_integer_dtype(series.dtype) and not pd.api.types.is_extension_array_dtype(series.dtype):
+        values = series.to_numpy()
+        nan_mask = np.zeros(len(values), dtype=bool)
+    else:
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        nan_mask = np.isnan(values)
+        if pd.api.types.is_integer_dtype(series.dtype) and not nan_mask.all():
+            exact = max(abs(int(series.min())), abs(int(series.max()))) <= FLOAT_EXACT_INT
+    values.setflags(write=False)
+    nan_mask.setflags(write=False)
+    return NumericColumn(values=values, nan_mask=nan_mask, exact=exact)
+
+
+def _get_or_build(df, store_name, key, build):
+    """Returns getattr(cache, store_name)[key], building it on first use.
+
+    The build runs outside the cache lock so that worker threads can build
+    different columns concurrently; if two threads race on the same key the
+    first stored value wins and is the one everybody gets.
+    """
+    cache = get_dataset_cache(df)
+    store = getattr(cache, store_name)
+    value = store.get(key)
+    if value is None:
+        built = build()
+        with cache.lock:
+            value = store.setdefault(key, built)
+    return value
+
+
+def get_numeric_column(df, column):
+    """Returns the NumericColumn for df[column], coercing it on first use only."""
+    return _get_or_build(df, 'numeric_columns', column, lambda: _coerce_numeric(df[column]))
+
+
+def _build_sort_index(numeric):
+    position_dtype = np.int32 if len(numeric.values) < 2**31 else np.int64
+    # argsort puts NaN last, so the valid values are a prefix of sorted_values
+    order = np.argsort(numeric.values, kind='stable').astype(position_dtype, copy=False)
+    sorted_values = numeric.values[order]
+    order.setflags(write=False)
+    sorted_values.setflags(write=False)
+    return SortIndex(order=order, sorted_values=sorted_values, valid_count=numeric.valid_count)
+
+
+def get_sort_index(df, column):
+    """Returns the SortIndex of df[column] (numeric view), building it on first use."""
+    return _get_or_build(df, 'sort_indexes', column,
+                         lambda: _build_sort_index(get_numeric_column(df, column)))
+
+
+def supports_value_index(dtype):
+    """Value indexes answer '==' exactly like pandas only for plain text-like
+    columns (pandas parses strings when comparing e.g. datetime columns)."""
+    return (isinstance(dtype, pd.CategoricalDtype)
+            or pd.api.types.is_object_dtype(dtype)
+            or pd.api.types.is_string_dtype(dtype))
+
+
+def _build_value_index(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        uniques = series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    n_codes = len(uniques)
+    code_dtype = np.int32 if n_codes < 2**31 else np.int64
+    codes = codes.astype(code_dtype, copy=False)
+    position_dtype = np.int32 if len(codes) < 2**31 else np.int64
+
+    # Stable sort keeps the rows of each value in ascending order; the missing
+    # values (code -1) end up first and are excluded by the offsets.
+    grouped_rows = np.argsort(codes, kind='stable').astype(position_dtype, copy=False)
+    counts = np.bincount(codes + 1, minlength=n_codes + 1)
+    offsets = np.cumsum(counts) # offsets[c] = start of code c, after the missing rows
+
+    for arr in (codes, grouped_rows, offsets):
+        arr.setflags(write=False)
+    code_of = {value: code for code, value in enumerate(uniques)}
+    return ValueIndex(codes=codes, grouped_rows=grouped_rows, offsets=offsets, code_of=code_of)
+
+
+def get_value_index(df, column):
+    """Returns the ValueIndex of df[column], building it on first use."""
+    return _get_or_build(df, 'value_indexes', column, lambda: _build_value_index(df[column]))
+
+
+HISTOGRAM_BINS = 32
+
+def get_column_stats(df, column):
+    """Returns the ColumnStats of df[column] (numeric view), computed once per dataset."""
+    cache = get_dataset_cache(df)
+    stats = cache.column_stats.get(column)
+    if stats is not None:
+        return stats
+    numeric = get_numeric_column(df, column)
+    valid_values = numeric.values[~numeric.nan_mask]
+    if len(valid_values):
+        v_min, v_max = float(valid_values.min()), float(valid_values.max())
+        hist_counts, hist_edges = np.histogram(valid_values, bins=HISTOGRAM_BINS, range=(v_min, v_max))
+        distinct_count = len(pd.unique(valid_values))
+    else:
+        v_min = v_max = np.nan
+        hist_counts, hist_edges = np.zeros(HISTOGRAM_BINS, dtype=np.int64), np.zeros(HISTOGRAM_BINS + 1)
+        distinct_count = 0
+    stats = ColumnStats(n_rows=len(valid_values) + int(np.count_nonzero(numeric.nan_mask)),
+                        valid_count=len(valid_values), distinct_count=distinct_count,
+                        min=v_min, max=v_max, hist_counts=hist_counts, hist_edges=hist_edges)
+    with cache.lock:
+        cache.column_stats[column] = stats
+    return stats
+
+
+def has_step_mask(df, key):
+    return key in get_dataset_cache(df).step_masks
+
+
+def peek_step_mask(df, key):
+    """The cached mask for key (a compiled filter step), or None."""
+    cache = get_dataset_cache(df)
+    with cache.lock:
+        mask = cache.step_masks.get(key)
+        if mask is not None:
+            cache.step_masks.move_to_end(key)
+        return mask
+
+
+def get_step_mask(df, key, compute):
+    """Returns the mask cached under key, calling compute() on a miss.
+
+    Masks are stored read-only and evicted least-recently-used first once the
+    per-dataset STEP_MASK_CACHE_BYTES budget is exceeded.
+    """
+    mask = peek_step_mask(df, key)
+    if mask is not None:
+        return mask
+    mask = compute()
+    mask.setflags(write=False)
+    if mask.nbytes > STEP_MASK_CACHE_BYTES:
+        return mask
+    cache = get_dataset_cache(df)
+    with cache.lock:
+        if key not in cache.step_masks:
+            cache.step_masks[key] = mask
+            cache.step_masks_bytes += mask.nbytes
+        while cache.step_masks_bytes > STEP_MASK_CACHE_BYTES:
+            _, evicted = cache.step_masks.popitem(last=False)
+            cache.step_masks_bytes -= evicted.nbytes
+    return mask
+
+
+def _argsort_text(values):
+    # sorted() on Python strings is several times faster than argsort of an object array
+    return np.array(sorted(range(len(values)), key=values.__getitem__), dtype=np.int64)
+
+
+def _text_value_counts(df, column):
+    series = df[column]
+    if supports_value_index(series.dtype):
+        # Counts straight from the value index, which the filters use as well
+        index = get_value_index(df, column)
+        counts = pd.Series(np.diff(index.offsets), index=[str(v) for v in index.code_of])
+    else:
+        counts = series.value_counts(dropna=True, sort=False)
+        # Same text as series.astype(str), converting only the distinct values
+        counts.index = pd.Series(counts.index).astype(str).to_numpy()
+    counts = counts[counts > 0] # unused categories
+    if counts.index.is_unique:
+        counts = counts.iloc[_argsort_text(counts.index.tolist())]
+    else: # values that print the same (e.g. 1 and '1')
+        counts = counts.groupby(level=0, sort=True).sum()
+    return counts, int(series.isna().sum())
+
+
+def _build_column_profile(df, column):
+    dtype = df[column].dtype
+    if pd.api.types.is_numeric_dtype(dtype):
+        stats = get_column_stats(df, column)
+        return ColumnProfile(kind='numeric', dtype=str(dtype), n_rows=stats.n_rows,
+                             null_count=stats.n_rows - stats.valid_count, distinct_count=stats.distinct_count,
+                             min=stats.min, max=stats.max, stats=stats)
+    value_counts, null_count = _text_value_counts(df, column)
+    return ColumnProfile(kind='text', dtype=str(dtype), n_rows=len(df), null_count=null_count,
+                         distinct_count=len(value_counts), value_counts=value_counts)
+
+
+def get_column_profile(df, column):
+    """Returns the ColumnProfile of df[column], computed on first use only."""
+    return _get_or_build(df, 'column_profiles', column, lambda: _build_column_profile(df, column))
+
+
+def get_column_catalog(df):
+    """{column: ColumnProfile} for every column of df.
+
+    Built once per dataset, right after loading (see
+    state_helpers.set_session_dataframe), so that rendering the filter widgets
+    only reads precomputed values. Columns with repeated names are skipped.
+    """
+    repeated = df.columns.duplicated(keep=False)
+    return {column: get_column_profile(df, column)
+            for column, is_repeated in zip(df.columns, repeated) if not is_repeated}
+
+
+def _build_value_search_index(value_counts):
+    folded_list = [fold_text(v) for v in value_counts.index]
+    order = _argsort_text(folded_list)
+    folded = np.array(folded_list, dtype=object)
+    counts = value_counts.to_numpy()[order]
+    # Most frequent first; ties in value order
+    by_frequency = np.argsort(-counts, kind='stable')
+    arrays = (value_counts.index.to_numpy(dtype=object)[order], folded[order], counts, by_frequency)
+    for arr in arrays:
+        arr.setflags(write=False)
+    return ValueSearchIndex(*arrays)
+
+
+def get_value_search_index(df, column):
+    """Returns the ValueSearchIndex of a text column, built from its catalog
+    value counts on first use."""
+    return _get_or_build(df, 'value_search_indexes', column,
+                         lambda: _build_value_search_index(get_column_profile(df, column).value_counts))
+
+
+def _build_value_ranks(index):
+    labels = [str(value) for value in index.code_of]
+    ranks = np.empty(len(labels) + 1, dtype=np.int64)
+    ranks[_argsort_text(labels)] = np.arange(len(labels))
+    ranks[-1] = len(labels) # code -1 (missing) sorts last
+    ranks.setflags(write=False)
+    return ranks
+
+
+def get_value_ranks(df, column):
+    """Position of each value code of the column's ValueIndex in text order:
+    ranks[codes] sorts the rows by value, missing values last."""
+    return _get_or_build(df, 'value_ranks', column, lambda: _build_value_ranks(get_value_index(df, column)))
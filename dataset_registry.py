@@ -0,0 +1,107 @@
+"""Process-wide registry of loaded datasets, deduplicated by content.
+
+Every Streamlit session used to keep its own copy of the DataFrame it loaded.
+Sessions now register what they load: the registry keeps one DataFrame per
+distinct content hash (dataset_cache.get_content_hash) and hands out
+DatasetHandles to it, so twenty analysts on the same weekly export share one
+copy, and also share its derived data (sorted/value indexes, step masks, ...)
+since dataset_cache is keyed by the DataFrame object.
+
+Shared DataFrames are read-only by contract: the app never modifies a loaded
+DataFrame in place, it replaces st.session_state.df. A dataset is evicted
+(and its derived data dropped) when the last handle to it is released, either
+explicitly or when the session holding it is garbage collected.
+"""
+import threading
+import weakref
+from dataclasses import dataclass
+
+from dataset_cache import drop_dataset_cache, get_content_hash
+
+
+@dataclass
+class _Entry:
+    df: object
+    refs: int
+    nbytes: int
+
+
+_registry = {} # content hash -> _Entry
+_registry_lock = threading.Lock()
+
+
+def _release(key, df):
+    if key is None:
+        drop_dataset_cache(df) # private (unhashable) dataset: nobody else uses it
+        return
+    with _registry_lock:
+        entry = _registry.get(key)
+        if entry is None:
+            return
+        entry.refs -= 1
+        if entry.refs > 0:
+            return
+        del _registry[key]
+    drop_dataset_cache(entry.df)
+
+
+class DatasetHandle:
+    """A session's reference to a registered dataset.
+
+    handle.df is the shared DataFrame. release() (or garbage collection of the
+    handle) gives the reference back; releasing twice has no effect.
+    """
+
+    def __init__(self, key, df):
+        self.key = key
+        self.df = df
+        self._finalizer = weakref.finalize(self, _release, key, df)
+
+    @property
+    def shared(self):
+        return self.key is not None
+
+    def release(self):
+        self._finalizer()
+
+
+def acquire_dataset(df, nbytes=None):
+    """Registers df and returns a DatasetHandle to the canonical copy of its
+    content: df itself for new content, or the already registered DataFrame
+    (df is then dropped by the caller) when another session loaded the same data.
+
+    DataFrames whose content cannot be hashed get a private handle. nbytes
+    (deep memory usage of df) is computed when not given.
+    """
+    key = get_content_hash(df)
+    if key is None:
+        return DatasetHandle(None, df)
+    with _registry_lock:
+        entry = _registry.get(key)
+        if entry is not None:
+            entry.refs += 1
+            canonical = entry.df
+    if entry is not None:
+        if canonical is not df:
+            drop_dataset_cache(df) # only its content hash was computed
+        return DatasetHandle(key, canonical)
+
+    if nbytes is None:
+        nbytes = int(df.memory_usage(deep=True).sum())
+    with _registry_lock:
+        entry = _registry.setdefault(key, _Entry(df=df, refs=0, nbytes=nbytes))
+        entry.refs += 1
+        canonical = entry.df
+    if canonical is not df: # registered meanwhile by another session
+        drop_dataset_cache(df)
+    return DatasetHandle(key, canonical)
+
+
+def registry_stats():
+    """Number of shared datasets, handles (sessions) referring to them and their bytes."""
+    with _registry_lock:
+        return {
+            'datasets': len(_registry),
+            'handles': sum(entry.refs for entry in _registry.values()),
+            'bytes': sum(entry.nbytes for entry in _registry.values()),
+        }
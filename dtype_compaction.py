@@ -0,0 +1,76 @@
+"""Lossless dtype compaction of loaded datasets.
+
+Parsers return int64/float64 numbers and object strings whatever the data.
+compact_dtypes shrinks each column to the smallest dtype that holds exactly
+the same values:
+
+- integers are downcast to the smallest signed type that fits (int8 ... int64);
+- floats become float32 only when every value survives the round trip
+  (typically integral counts with missing values; odds such as 1.85 are not
+  representable in float32 and stay float64);
+- text columns with few distinct values (team, league, market names) become
+  'category', which stores each distinct string once plus small integer codes.
+
+Numeric columns stay numeric and text columns stay non-numeric, so the filter
+UI offers the same conditions; the filter engine reads category codes directly.
+"""
+import numpy as np
+import pandas as pd
+
+# Text columns are converted to 'category' when distinct values are at most
+# this fraction of the non-missing values.
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+
+def _compact_integer(series):
+    return pd.to_numeric(series, downcast='integer')
+
+
+def _compact_float(series):
+    values = series.to_numpy()
+    as_float32 = values.astype(np.float32)
+    with np.errstate(over='ignore', invalid='ignore'):
+        lossless = np.array_equal(as_float32.astype(np.float64), values, equal_nan=True)
+    return pd.Series(as_float32, index=series.index, name=series.name) if lossless else series
+
+
+def _compact_text(series, max_unique_ratio):
+    if pd.api.types.infer_dtype(series, skipna=True) != 'string':
+        return series # mixed types (e.g. numbers and text) keep their object values as they are
+    non_missing = series.count()
+    if non_missing == 0 or series.nunique(dropna=True) > non_missing * max_unique_ratio:
+        return series
+    return series.astype('category')
+
+
+def compact_column(series, max_unique_ratio=CATEGORY_MAX_UNIQUE_RATIO):
+    """The column with the smallest dtype holding the same values (or itself)."""
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_extension_array_dtype(dtype):
+        return series
+    if pd.api.types.is_integer_dtype(dtype):
+        return _compact_integer(series)
+    if pd.api.types.is_float_dtype(dtype) and dtype != np.float32:
+        return _compact_float(series)
+    if pd.api.types.is_object_dtype(dtype):
+        return _compact_text(series, max_unique_ratio)
+    return series
+
+
+def compact_dtypes(df, max_unique_ratio=CATEGORY_MAX_UNIQUE_RATIO):
+    """Returns (compacted DataFrame, report) without modifying df.
+
+    report has 'memory_before' and 'memory_after' (bytes, deep) and
+    'converted': {column: (old dtype, new dtype)} for the columns that changed.
+    """
+    memory_before = int(df.memory_usage(deep=True).sum())
+    compacted = df.copy(deep=False)
+    converted = {}
+    for position, column in enumerate(df.columns):
+        series = df.iloc[:, position]
+        new_series = compact_column(series, max_unique_ratio)
+        if new_series is not series and new_series.dtype != series.dtype:
+            compacted.isetitem(position, new_series) # by position: column names may repeat
+            converted[column] = (str(series.dtype), str(new_series.dtype))
+    memory_after = int(compacted.memory_usage(deep=True).sum()) if converted else memory_before
+    return compacted, {'memory_before': memory_before, 'memory_after': memory_after, 'converted': converted}
@@ -0,0 +1,374 @@
+"""Compilation of filter configs into typed, cached execution plans.
+
+A filter list (same shape as st.session_state.filters / named_filters.json) is
+validated and coerced once against the dataset schema and turned into a
+FilterPlan: a tuple of immutable steps that only know how to compute their
+boolean mask. Plans are kept in a bounded LRU so reruns with an unchanged filter
+set skip all parsing, dtype lookups and pd.to_numeric work.
+"""
+import hashlib
+import json
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import (
+    get_numeric_column,
+    get_sort_index,
+    get_value_index,
+    supports_value_index
+)
+
+PLAN_CACHE_SIZE = 128 # Maximum number of compiled plans kept in memory
+
+COMPARISON_OPS = {
+    '>': np.greater, '<': np.less, '>=': np.greater_equal,
+    '<=': np.less_equal, '==': np.equal, '!=': np.not_equal,
+}
+
+# Keys that only matter to the UI and never change the filter result
+_UI_ONLY_KEYS = ('type_display_name',)
+
+
+@dataclass(frozen=True)
+class FilterStep(ABC):
+    """Base class for compiled steps. Equality/hash only consider the fields that
+    define the predicate, so identical predicates compare equal wherever they
+    appear in a filter list."""
+    position: int = field(compare=False) # 0-based position in the user's filter list
+    filter_type: str = field(compare=False)
+
+    @property
+    def columns(self):
+        return ()
+
+    def error_message(self, error):
+        col = self.columns[0] if self.columns else None
+        return f"Erro ao aplicar filtro {self.position+1} (Tipo: {self.filter_type}, Col: {col}): {error}"
+
+    @abstractmethod
+    def mask(self, df):
+        """Boolean mask of the rows of df passing this step (len(df) results)."""
+
+    def mask_at(self, df, rows):
+        """Mask restricted to the given row positions (len(rows) results)."""
+        return self.mask(df)[rows]
+
+    def index_slice(self, df):
+        """(SortIndex, start, stop) resolving this step through a sorted-column
+        index, or None when the predicate cannot be answered by one."""
+        return None
+
+
+@dataclass(frozen=True)
+class NumericValueStep(FilterStep):
+    """'column_value' on a numeric column: column <op> value."""
+    column: str = None
+    op: str = '=='
+    value: float = 0.0
+
+    @property
+    def columns(self):
+        return (self.column,)
+
+    def mask(self, df):
+        numeric = get_numeric_column(df, self.column)
+        if not numeric.exact:
+            return self._series_mask(df[self.column])
+        mask = COMPARISON_OPS[self.op](numeric.values, self.value)
+        if self.drops_missing(df[self.column].dtype):
+            np.logical_and(mask, ~numeric.nan_mask, out=mask)
+        return mask
+
+    def mask_at(self, df, rows):
+        numeric = get_numeric_column(df, self.column)
+        if not numeric.exact:
+            return self._series_mask(df[self.column].iloc[rows])
+        mask = COMPARISON_OPS[self.op](numeric.values[rows], self.value)
+        if self.drops_missing(df[self.column].dtype):
+            np.logical_and(mask, ~numeric.nan_mask[rows], out=mask)
+        return mask
+
+    def _series_mask(self, series):
+        # Integers the float64 view would round: compare the column's own values
+        return COMPARISON_OPS[self.op](series, self.value).fillna(False).to_numpy(dtype=bool)
+
+    def drops_missing(self, dtype):
+        # NaN != value is True for the coerced float values, but nullable
+        # extension dtypes (Int64, Float64, boolean) compare to <NA>, which
+        # pandas boolean indexing drops, as for TextValueStep.
+        return self.op == '!=' and pd.api.types.is_extension_array_dtype(dtype)
+
+    def index_slice(self, df):
+        if self.op == '!=' or not get_numeric_column(df, self.column).exact:
+            return None # not a single slice of the sorted column
+        index = get_sort_index(df, self.column)
+        start, stop = index.bounds_for(self.op, self.value)
+        return index, start, stop
+
+
+@dataclass(frozen=True)
+class TextValueStep(FilterStep):
+    """'column_value' on a non-numeric column: equality or inequality."""
+    column: str = None
+    op: str = '=='
+    value: object = None
+
+    @property
+    def columns(self):
+        return (self.column,)
+
+    def mask(self, df):
+        series = df[self.column]
+        if supports_value_index(series.dtype):
+            index = get_value_index(df, self.column)
+            equal_mask = np.zeros(len(df), dtype=bool)
+            equal_mask[index.positions(*index.bounds_for_value(self.value))] = True
+            missing = (index.codes == -1) if self.drops_missing(series.dtype) else None
+        else:
+            equal_mask = (series == self.value).to_numpy(dtype=bool, na_value=False)
+            missing = series.isna().to_numpy() if self.drops_missing(series.dtype) else None
+        return self._finish(equal_mask, missing)
+
+    def mask_at(self, df, rows):
+        series = df[self.column]
+        if supports_value_index(series.dtype):
+            index = get_value_index(df, self.column)
+            code = index.code_for(self.value)
+            row_codes = index.codes[rows]
+            equal_mask = row_codes == (-2 if code is None else code)
+            missing = (row_codes == -1) if self.drops_missing(series.dtype) else None
+        else:
+            subset = series.iloc[rows]
+            equal_mask = (subset == self.value).to_numpy(dtype=bool, na_value=False)
+            missing = subset.isna().to_numpy() if self.drops_missing(series.dtype) else None
+        return self._finish(equal_mask, missing)
+
+    def drops_missing(self, dtype):
+        # Missing values are kept by '!=' for object/categorical columns (numpy
+        # semantics) but dropped for nullable extension dtypes, whose comparison
+        # yields <NA>, as pandas boolean indexing does.
+        return (self.op == '!=' and pd.api.types.is_extension_array_dtype(dtype)
+                and not isinstance(dtype, pd.CategoricalDtype))
+
+    def _finish(self, equal_mask, missing):
+        if self.op == '==':
+            return equal_mask
+        np.logical_not(equal_mask, out=equal_mask)
+        if missing is not None:
+            np.logical_and(equal_mask, ~missing, out=equal_mask)
+        return equal_mask
+
+    def index_slice(self, df):
+        if self.op != '==' or not supports_value_index(df[self.column].dtype):
+            return None
+        index = get_value_index(df, self.column)
+        start, stop = index.bounds_for_value(self.value)
+        return index, start, stop
+
+
+@dataclass(frozen=True)
+class RangeStep(FilterStep):
+    """'column_range': low <= column <= high, ignoring non-numeric values."""
+    column: str = None
+    low: float = 0.0
+    high: float = 0.0
+
+    @property
+    def columns(self):
+        return (self.column,)
+
+    def mask(self, df):
+        numeric = get_numeric_column(df, self.column)
+        return self._range_mask(numeric.values if numeric.exact else df[self.column])
+
+    def mask_at(self, df, rows):
+        numeric = get_numeric_column(df, self.column)
+        return self._range_mask(numeric.values[rows] if numeric.exact else df[self.column].iloc[rows])
+
+    def _range_mask(self, num_values):
+        if isinstance(num_values, pd.Series): # integers the float64 view would round
+            return ((num_values >= self.low) & (num_values <= self.high)).fillna(False).to_numpy(dtype=bool)
+        # NaN never satisfies >= / <=, so missing values drop out without an explicit notna()
+        mask = num_values >= self.low
+        np.logical_and(mask, num_values <= self.high, out=mask)
+        return mask
+
+    def index_slice(self, df):
+        if not get_numeric_column(df, self.column).exact:
+            return None
+        index = get_sort_index(df, self.column)
+        start, stop = index.range_bounds(self.low, self.high)
+        return index, start, stop
+
+
+@dataclass(frozen=True)
+class ComparisonStep(FilterStep):
+    """'column_comparison': column1 <op> column2 on rows where both are numeric.
+    An unknown op keeps no rows, as before."""
+    column1: str = None
+    op: str = None
+    column2: str = None
+
+    @property
+    def columns(self):
+        return (self.column1, self.column2)
+
+    def mask(self, df):
+        return self._compare(df, slice(None), len(df))
+
+    def mask_at(self, df, rows):
+        return self._compare(df, rows, len(rows))
+
+    def _compare(self, df, rows, n_rows):
+        if self.op not in COMPARISON_OPS:
+            return np.zeros(n_rows, dtype=bool)
+        s1_numeric = get_numeric_column(df, self.column1)
+        s2_numeric = get_numeric_column(df, self.column2)
+        mask = COMPARISON_OPS[self.op](s1_numeric.values[rows], s2_numeric.values[rows])
+        if self.op == '!=':
+            # NaN != x is True for numpy; rows without two comparable values must drop out
+            np.logical_and(mask, ~s1_numeric.nan_mask[rows], out=mask)
+            np.logical_and(mask, ~s2_numeric.nan_mask[rows], out=mask)
+        return mask
+
+
+@dataclass(frozen=True)
+class FilterPlan:
+    """Validated execution plan for one filter list against one dataset schema.
+
+    messages holds the ('warning'|'error', text) pairs produced while compiling;
+    they are shown again on every evaluation so cached plans behave like fresh ones.
+    """
+    key: str
+    steps: tuple
+    messages: tuple
+
+
+def _is_number(value):
+    return pd.api.types.is_number(value) and not isinstance(value, (bool, np.bool_))
+
+
+def _compile_column_value(df, f_config, i):
+    col = f_config.get('column')
+    cond, val = f_config.get('condition'), f_config.get('value')
+    if not col or val is None or (isinstance(val, str) and val == ''):
+        return None, None
+
+    target_dtype = df[col].dtype
+    if pd.api.types.is_numeric_dtype(target_dtype):
+        try:
+            val = pd.to_numeric(val)
+        except ValueError:
+            return None, ('warning', f"Filtro {i+1} ({col}): Valor '{val}' incompatível com tipo numérico da coluna. Filtro ignorado.")
+        if cond not in COMPARISON_OPS:
+            return None, None
+        return NumericValueStep(i, 'column_value', column=col, op=cond, value=val.item() if hasattr(val, 'item') else val), None
+
+    if cond in ('==', '!='):
+        return TextValueStep(i, 'column_value', column=col, op=cond, value=val), None
+    if cond in ['>', '<', '>=', '<=']:
+        return None, ('warning', f"Filtro {i+1} ({col}): Operação '{cond}' não aplicável a coluna não numérica. Filtro ignorado.")
+    return None, None
+
+
+def _compile_column_range(df, f_config, i):
+    col, rng_val = f_config.get('column'), f_config.get('value')
+    if not col or not rng_val or not (isinstance(rng_val, (list,tuple)) and len(rng_val)==2):
+        return None, None
+    if col not in df.columns:
+        raise KeyError(col)
+    min_v, max_v = rng_val[0], rng_val[1]
+    if not (_is_number(min_v) and _is_number(max_v)):
+        raise TypeError(f"limites do intervalo não numéricos: {min_v!r}, {max_v!r}")
+    # Python numbers, not float(): integer bounds stay exact beyond 2**53
+    low, high = (v.item() if hasattr(v, 'item') else v for v in (min_v, max_v))
+    return RangeStep(i, 'column_range', column=col, low=low, high=high), None
+
+
+def _compile_column_comparison(df, f_config, i):
+    c1, cnd, c2 = f_config.get('column1'), f_config.get('condition'), f_config.get('column2')
+    if not c1 or not c2:
+        return None, None
+    for c in (c1, c2):
+        if c not in df.columns:
+            raise KeyError(c)
+    return ComparisonStep(i, 'column_comparison', column1=c1, op=cnd, column2=c2), None
+
+
+_COMPILERS = {
+    'column_value': _compile_column_value,
+    'column_range': _compile_column_range,
+    'column_comparison': _compile_column_comparison,
+}
+
+
+def canonical_filters_json(active_filters):
+    """Stable JSON text for a filter list, ignoring UI-only keys."""
+    cleaned = [
+        {k: v for k, v in f_config.items() if k not in _UI_ONLY_KEYS}
+        for f_config in (active_filters or [])
+    ]
+    return json.dumps(cleaned, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def schema_fingerprint(df):
+    """Fingerprint of everything a plan depends on: column names and dtypes.
+    Cheap (O(number of columns)), so it can be computed on every rerun."""
+    schema = [(str(col), str(dtype)) for col, dtype in df.dtypes.items()]
+    return hashlib.sha1(json.dumps(schema).encode('utf-8')).hexdigest()
+
+
+def compile_filters(df, active_filters, key=None):
+    """Validates and coerces active_filters against df's schema, returning a FilterPlan.
+
+    Incomplete filters are dropped; incompatible ones become warnings and filters
+    that fail (e.g. unknown column) become errors, matching apply_filters_to_dataframe.
+    """
+    steps, messages = [], []
+    for i, f_config in enumerate(active_filters or []):
+        compiler = _COMPILERS.get(f_config.get('type'))
+        if compiler is None:
+            continue
+        try:
+            step, message = compiler(df, f_config, i)
+        except Exception as e:
+            col = f_config.get('column') or f_config.get('column1')
+            messages.append(('error', f"Erro ao aplicar filtro {i+1} (Tipo: {f_config.get('type')}, Col: {col}): {e}"))
+            continue
+        if message:
+            messages.append(message)
+        if step is not None:
+            steps.append(step)
+    return FilterPlan(key=key, steps=tuple(steps), messages=tuple(messages))
+
+
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+
+def plan_cache_key(df, active_filters):
+    text = canonical_filters_json(active_filters) + '|' + schema_fingerprint(df)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def get_filter_plan(df, active_filters):
+    """Returns the compiled plan for active_filters on df, compiling it on a cache miss."""
+    key = plan_cache_key(df, active_filters)
+    with _plan_cache_lock:
+        plan = _plan_cache.get(key)
+        if plan is not None:
+            _plan_cache.move_to_end(key)
+            return plan
+
+    plan = compile_filters(df, active_filters, key=key)
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        _plan_cache.move_to_end(key)
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
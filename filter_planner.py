@@ -0,0 +1,129 @@
+"""Cost-based ordering of compiled filter steps.
+
+Every step gets an estimated selectivity (fraction of rows it keeps) from the
+dataset's column catalog (min/max/histogram/distinct count, or the exact value
+frequencies of a text column's value index) and a relative per-row cost. The
+AND-chain is then ordered so that steps that discard many rows for little work
+run first; later steps only see the rows that survived. Ordering never changes
+the result, only the work done.
+"""
+from dataclasses import dataclass
+
+import pandas as pd
+
+from dataset_cache import (
+    get_column_profile,
+    get_column_stats,
+    get_value_index,
+    has_step_mask,
+    supports_value_index
+)
+from filter_plan import ComparisonStep, NumericValueStep, RangeStep, TextValueStep
+
+# Relative cost of evaluating one row, by kind of work
+COST_CACHED_MASK = 0.1   # AND with a mask kept from a previous rerun
+COST_NUMERIC_OP = 1.0    # one vectorized float comparison
+COST_INDEXED_TEXT = 1.0  # value index lookup / integer code comparison
+COST_TEXT_SCAN = 10.0    # object-dtype comparison
+DEFAULT_SELECTIVITY = 0.5
+
+
+@dataclass(frozen=True)
+class StepEstimate:
+    step: object
+    selectivity: float
+    cost: float
+    method: str
+
+    @property
+    def rank(self):
+        # Classic ordering for conjunctive predicates: cost per unit of rows removed
+        return self.cost / max(1.0 - self.selectivity, 1e-9)
+
+
+def _numeric_selectivity(stats, op, value, drops_missing=False):
+    if stats.n_rows == 0 or stats.valid_count == 0:
+        return 0.0
+    valid_fraction = stats.valid_count / stats.n_rows
+    at_most = stats.fraction_at_most(value)
+    equal = (1.0 / stats.distinct_count) if stats.min <= value <= stats.max else 0.0
+    if op == '==':
+        fraction = equal
+    elif op == '!=':
+        if drops_missing: # nullable dtypes: <NA> != value drops missing rows
+            return (1.0 - equal) * valid_fraction
+        return 1.0 - equal * valid_fraction # NaN != value keeps missing rows
+    elif op == '<=':
+        fraction = at_most
+    elif op == '<':
+        fraction = max(at_most - equal, 0.0)
+    elif op == '>':
+        fraction = 1.0 - at_most
+    else: # '>='
+        fraction = min(1.0 - at_most + equal, 1.0)
+    return fraction * valid_fraction
+
+
+def estimate_step(df, step):
+    """Returns the StepEstimate (selectivity, cost, access method) of a compiled step."""
+    cached = has_step_mask(df, step)
+    if isinstance(step, RangeStep):
+        stats = get_column_stats(df, step.column)
+        if stats.valid_count == 0 or step.low > step.high:
+            selectivity = 0.0
+        else:
+            fraction = stats.fraction_at_most(step.high) - stats.fraction_at_most(step.low)
+            selectivity = max(fraction, 0.0) * stats.valid_count / stats.n_rows
+        cost, method = 2 * COST_NUMERIC_OP, 'intervalo numérico'
+    elif isinstance(step, NumericValueStep):
+        selectivity = _numeric_selectivity(get_column_stats(df, step.column), step.op, step.value,
+                                           step.drops_missing(df[step.column].dtype))
+        cost, method = COST_NUMERIC_OP, 'comparação numérica'
+    elif isinstance(step, TextValueStep):
+        if supports_value_index(df[step.column].dtype):
+            index = get_value_index(df, step.column)
+            start, stop = index.bounds_for_value(step.value)
+            equal = (stop - start) / max(len(df), 1) # exact, from the value index
+            cost, method = COST_INDEXED_TEXT, 'índice de valores'
+        else:
+            equal = 1.0 / max(get_column_profile(df, step.column).distinct_count, 1)
+            cost, method = COST_TEXT_SCAN, 'comparação de texto'
+        selectivity = equal if step.op == '==' else 1.0 - equal
+    elif isinstance(step, ComparisonStep):
+        # No joint statistics: assume independence between the two columns
+        s1, s2 = get_column_stats(df, step.column1), get_column_stats(df, step.column2)
+        both_valid = (s1.valid_count / max(s1.n_rows, 1)) * (s2.valid_count / max(s2.n_rows, 1))
+        if step.op == '==':
+            selectivity = both_valid * 0.05
+        elif step.op in ('>', '<', '>=', '<=', '!='):
+            selectivity = both_valid * DEFAULT_SELECTIVITY
+        else:
+            selectivity = 0.0 # unknown operator keeps no rows
+        cost, method = 2 * COST_NUMERIC_OP, 'comparação entre colunas'
+    else:
+        selectivity, cost, method = DEFAULT_SELECTIVITY, COST_NUMERIC_OP, 'varredura'
+
+    if cached:
+        cost, method = COST_CACHED_MASK, 'máscara em cache'
+    return StepEstimate(step=step, selectivity=min(max(selectivity, 0.0), 1.0), cost=cost, method=method)
+
+
+def order_steps(df, steps):
+    """Returns the StepEstimates of steps, most selective/cheapest first.
+    Ties keep the user's order, so the result is deterministic."""
+    estimates = []
+    for step in steps:
+        try:
+            estimates.append(estimate_step(df, step))
+        except Exception:
+            # Unknown column etc.: keep it, the error is reported at evaluation
+            estimates.append(StepEstimate(step=step, selectivity=1.0, cost=COST_NUMERIC_OP, method='varredura'))
+    return sorted(estimates, key=lambda e: (e.rank, e.step.position))
+
+
+def plan_report_frame(report):
+    """DataFrame view of the report filled by apply_filters_to_dataframe(report=...)."""
+    return pd.DataFrame(report, columns=[
+        'Ordem', 'Filtro', 'Tipo', 'Coluna(s)', 'Acesso',
+        'Seletividade Estimada', 'Linhas Estimadas', 'Linhas Após o Filtro',
+    ])
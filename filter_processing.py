@@ -1,80 +1,406 @@
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 import streamlit as st # For st.warning/st.error, consider using a logger for better separation
 
-def apply_filters_to_dataframe(original_df, active_filters):
+from dataset_cache import SortIndex, get_step_mask, peek_step_mask
+from filter_plan import get_filter_plan
+from filter_planner import order_steps
+from fused_kernel import evaluate_fused
+from result_bitmaps import PackedBitmap
+from result_cache import get_cached_result, result_cache_key, store_result
+
+# Default size of the thread pool used to evaluate many filter sets at once
+DEFAULT_SET_WORKERS = min(4, os.cpu_count() or 1)
+
+# Evaluation backends:
+#   'masks' -> one (cached) mask per filter, sorted/value indexes, candidate rows
+#   'fused' -> all filters fused into chunk kernels over cache-sized row blocks
+BACKENDS = ('masks', 'fused')
+
+# Output modes accepted by apply_filters_to_dataframe:
+#   'dataframe' -> filtered DataFrame (rows materialized once, at the end)
+#   'mask'      -> boolean numpy array aligned with original_df rows
+#   'indices'   -> integer positions (iloc) of the rows that pass every filter
+OUTPUT_MODES = ('dataframe', 'mask', 'indices')
+
+def _emit_messages(messages):
+    # It's generally better to log errors or display a generic message in UI
+    # st.error might be too intrusive if many filters cause minor issues.
+    for level, text in messages:
+        if level == 'error':
+            st.error(text)
+        else:
+            st.warning(text)
+
+# The sorted-column index path is taken when the most selective indexed step
+# keeps at most this fraction of the rows; above it a full mask scan is cheaper
+# than gathering the candidate rows for the remaining steps.
+INDEX_SELECTIVITY_THRESHOLD = 0.25
+# On the mask path, once the surviving rows drop to this fraction the remaining
+# steps are evaluated on the surviving row positions only.
+CANDIDATE_ROWS_THRESHOLD = 0.1
+
+def _pick_index_step(original_df, steps):
+    """(step, index, start, stop) for the indexed step with the fewest matches,
+    found with two binary searches per step (O(log n)), or None."""
+    best = None
+    for step in steps:
+        try:
+            resolved = step.index_slice(original_df)
+        except Exception:
+            continue # the error is reported when the step is evaluated normally
+        if resolved is not None:
+            index, start, stop = resolved
+            if best is None or stop - start < best[3] - best[2]:
+                best = (step, index, start, stop)
+    return best
+
+def _rows_to_mask(n_rows, rows):
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[rows] = True
+    return mask
+
+def _full_step_mask(original_df, step, use_index):
+    """Full-length mask of one step; selective indexed steps scatter their
+    index slice (O(log n + k)) instead of comparing every row."""
+    if use_index:
+        resolved = step.index_slice(original_df)
+        if resolved is not None:
+            index, start, stop = resolved
+            if stop - start <= len(original_df) * INDEX_SELECTIVITY_THRESHOLD:
+                return _rows_to_mask(len(original_df), index.positions(start, stop))
+    return step.mask(original_df)
+
+def _report_step(report, order, estimate, n_rows, method, surviving):
+    if report is None:
+        return
+    step = estimate.step
+    report.append({
+        'Ordem': order,
+        'Filtro': step.position + 1,
+        'Tipo': step.filter_type,
+        'Coluna(s)': ", ".join(str(c) for c in step.columns),
+        'Acesso': method,
+        'Seletividade Estimada': round(estimate.selectivity, 4),
+        'Linhas Estimadas': int(round(estimate.selectivity * n_rows)),
+        'Linhas Após o Filtro': surviving,
+    })
+
+def _evaluate_fused(original_df, plan, messages, report=None):
+    estimates = order_steps(original_df, plan.steps)
+    mask = evaluate_fused(original_df, [e.step for e in estimates], messages)
+    if report is not None:
+        for order, estimate in enumerate(estimates, start=1):
+            # Chunks are filtered by all steps at once: only the final count exists
+            surviving = int(np.count_nonzero(mask)) if order == len(estimates) else None
+            _report_step(report, order, estimate, len(original_df), 'kernel fundido', surviving)
+    return 'mask', mask
+
+def _evaluate_plan(original_df, plan, messages, use_index, report=None, backend='masks'):
+    """Returns ('rows', sorted positions) or ('mask', boolean mask).
+
+    Steps run in the order chosen by the cost-based planner. With use_index, a
+    selective enough indexed step supplies the candidate rows up front (O(log n + k));
+    otherwise steps produce full masks until the survivors are few, after which
+    the remaining steps are only evaluated on the surviving rows. `report`, when
+    given, receives one dict per step with its estimated and actual row counts.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend deve ser um de {BACKENDS}, recebido '{backend}'")
+    if backend == 'fused':
+        return _evaluate_fused(original_df, plan, messages, report)
+
+    n_rows = len(original_df)
+    estimates = order_steps(original_df, plan.steps)
+    rows, mask = None, None
+
+    if use_index:
+        best = _pick_index_step(original_df, plan.steps)
+        if best is not None and best[3] - best[2] <= n_rows * INDEX_SELECTIVITY_THRESHOLD:
+            best_step, index, start, stop = best
+            rows = index.positions(start, stop)
+            best_estimate = next(e for e in estimates if e.step is best_step)
+            estimates = [e for e in estimates if e.step is not best_step]
+            method = 'índice ordenado' if isinstance(index, SortIndex) else 'índice de valores'
+            _report_step(report, 1, best_estimate, n_rows, method, len(rows))
+
+    first_order = len(plan.steps) - len(estimates) + 1
+    for order, estimate in enumerate(estimates, start=first_order):
+        step, method = estimate.step, estimate.method
+        try:
+            if rows is not None:
+                method = f"{method} (em {len(rows)} linhas candidatas)"
+                cached_mask = peek_step_mask(original_df, step)
+                if cached_mask is not None:
+                    rows = rows[cached_mask[rows]]
+                else:
+                    rows = rows[step.mask_at(original_df, rows)]
+                surviving = len(rows)
+            else:
+                # Each step's mask is cached per dataset, keyed by the step itself (its
+                # normalized predicate), so after editing one filter only that filter's
+                # mask is recomputed; the others are reused and just ANDed again.
+                step_mask = get_step_mask(original_df, step,
+                                          lambda step=step: _full_step_mask(original_df, step, use_index))
+                if mask is None:
+                    mask = step_mask.copy() # cached masks are read-only
+                else:
+                    np.logical_and(mask, step_mask, out=mask)
+                surviving = int(np.count_nonzero(mask))
+                if surviving <= n_rows * CANDIDATE_ROWS_THRESHOLD:
+                    rows, mask = np.flatnonzero(mask), None
+        except Exception as e:
+            if messages is not None:
+                messages.append(('error', step.error_message(e)))
+            method, surviving = 'erro (filtro ignorado)', None
+        _report_step(report, order, estimate, n_rows, method, surviving)
+
+    if rows is not None:
+        return 'rows', rows
+    return 'mask', mask if mask is not None else np.ones(n_rows, dtype=bool)
+
+def evaluate_filter_plan(original_df, plan, messages=None, use_index=True, backend='masks'):
+    """ANDs every step of a compiled plan into a single boolean mask, without
+    copying the DataFrame.
+
+    Steps that raise are skipped; their error text is appended to `messages`
+    (a list of (level, text) pairs) instead of being shown directly, so this can
+    run outside the Streamlit script thread.
+    """
+    kind, result = _evaluate_plan(original_df, plan, messages, use_index, backend=backend)
+    return result if kind == 'mask' else _rows_to_mask(len(original_df), result)
+
+def _run_filters(original_df, active_filters, use_index, report=None, backend='masks', use_cache=True):
+    # Results are shared through the process-wide result cache: the same filters
+    # on the same data (even another session's copy of it) are computed once.
+    # The backend and use_index only change how a result is computed, not the result.
+    key = result_cache_key(original_df, active_filters) if use_cache else None
+    cached = get_cached_result(key, need_report=report is not None)
+    if cached is not None:
+        if report is not None:
+            report.extend(cached.report)
+        _emit_messages(cached.messages)
+        return 'rows', cached.positions
+
+    plan = get_filter_plan(original_df, active_filters)
+    messages = list(plan.messages)
+    kind, result = _evaluate_plan(original_df, plan, messages, use_index, report, backend)
+    _emit_messages(messages)
+    if key is not None:
+        positions = result if kind == 'rows' else np.flatnonzero(result)
+        store_result(key, positions, messages, report)
+    return kind, result
+
+def apply_filters_to_dataframe(original_df, active_filters, output='dataframe', use_index=True, report=None,
+                               backend='masks', use_cache=True):
+    """Applies the active filters to original_df.
+
+    Args:
+        original_df (pd.DataFrame): Data to filter. It is never copied or modified.
+        active_filters (list): Filter configs as stored in st.session_state.filters.
+        output (str, optional): 'dataframe' (default) returns the filtered rows,
+            'mask' the boolean row mask and 'indices' the integer row positions.
+        use_index (bool, optional): Resolve selective range/numeric filters through
+            per-column sorted indexes (built once per dataset). Defaults to True.
+        report (list, optional): When given, receives one dict per executed step
+            (planned order, access method, estimated and actual row counts);
+            see filter_planner.plan_report_frame.
+        backend (str, optional): 'masks' (default) keeps per-filter masks cached
+            between reruns; 'fused' evaluates all filters in one pass over
+            cache-sized row chunks with bounded temporary memory.
+        use_cache (bool, optional): Look the result up in (and add it to) the
+            process-wide result cache shared by all sessions. Defaults to True.
+    """
+    if output not in OUTPUT_MODES:
+        raise ValueError(f"output deve ser um de {OUTPUT_MODES}, recebido '{output}'")
+    if backend not in BACKENDS:
+        raise ValueError(f"backend deve ser um de {BACKENDS}, recebido '{backend}'")
+
     if not active_filters or original_df is None or original_df.empty:
-        return original_df if original_df is not None else pd.DataFrame()
-    
-    df_filtered = original_df.copy()
+        if output == 'dataframe':
+            return original_df if original_df is not None else pd.DataFrame()
+        n_rows = 0 if original_df is None else len(original_df)
+        return np.ones(n_rows, dtype=bool) if output == 'mask' else np.arange(n_rows)
+
+    kind, result = _run_filters(original_df, active_filters, use_index, report, backend, use_cache)
+
+    if kind == 'rows':
+        if output == 'indices':
+            return result
+        if output == 'dataframe':
+            return original_df.iloc[result]
+        return _rows_to_mask(len(original_df), result)
+
+    if output == 'mask':
+        return result
+    if output == 'indices':
+        return np.flatnonzero(result)
+    # Rows are materialized exactly once, whatever the number of filters
+    return original_df[result]
+
+class _SharedStepMasks:
+    """Thread-safe, evaluate-once store of step masks shared by several plans.
 
-    for i, f_config in enumerate(active_filters):
+    The first caller that needs a step computes its mask; concurrent callers
+    wait for that result. A mask is released after the last plan using it has
+    called release(), so only masks still needed by pending sets stay alive.
+    """
+
+    def __init__(self, original_df, plans, use_index):
+        self._df = original_df
+        self._use_index = use_index
+        self._uses = Counter(step for plan in plans for step in set(plan.steps))
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.busy_seconds = 0.0 # time spent computing masks, summed over threads
+
+    def get(self, step):
+        """The step's mask; raises the step's exception if it failed."""
+        with self._lock:
+            future = self._futures.get(step)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[step] = future
+        if owner:
+            t0 = time.perf_counter()
+            try:
+                future.set_result(get_step_mask(
+                    self._df, step, lambda: _full_step_mask(self._df, step, self._use_index)))
+            except Exception as e:
+                future.set_exception(e)
+            self.add_busy_time(time.perf_counter() - t0)
+        return future.result()
+
+    def add_busy_time(self, seconds):
+        with self._lock:
+            self.busy_seconds += seconds
+
+    def release(self, steps):
+        with self._lock:
+            for step in set(steps):
+                self._uses[step] -= 1
+                if self._uses[step] == 0:
+                    self._futures.pop(step, None)
+
+def _assemble_set_mask(n_rows, plan, shared_masks):
+    """AND of the shared step masks of one plan, plus its (level, text) messages."""
+    messages = list(plan.messages)
+    mask = np.ones(n_rows, dtype=bool)
+    for step in plan.steps:
         try:
-            filter_type = f_config.get('type')
-            col = f_config.get('column') # Used by column_value and column_range
-
-            if filter_type == 'column_value':
-                cond, val = f_config.get('condition'), f_config.get('value')
-                if not col or val is None or (isinstance(val, str) and val == ''):
-                    continue
-                
-                target_dtype = original_df[col].dtype
-                try: 
-                    if pd.api.types.is_numeric_dtype(target_dtype):
-                        val = pd.to_numeric(val)
-                except ValueError:
-                    st.warning(f"Filtro {i+1} ({col}): Valor '{val}' incompatível com tipo numérico da coluna. Filtro ignorado.")
-                    continue
-                
-                if cond == '==': df_filtered = df_filtered[df_filtered[col] == val]
-                elif cond == '!=': df_filtered = df_filtered[df_filtered[col] != val]
-                elif pd.api.types.is_numeric_dtype(target_dtype): 
-                    if cond == '>': df_filtered = df_filtered[df_filtered[col] > val]
-                    elif cond == '<': df_filtered = df_filtered[df_filtered[col] < val]
-                    elif cond == '>=': df_filtered = df_filtered[df_filtered[col] >= val]
-                    elif cond == '<=': df_filtered = df_filtered[df_filtered[col] <= val]
-                elif cond in ['>', '<', '>=', '<=']: 
-                    st.warning(f"Filtro {i+1} ({col}): Operação '{cond}' não aplicável a coluna não numérica. Filtro ignorado.")
-                    continue
-
-            elif filter_type == 'column_range':
-                rng_val = f_config.get('value')
-                if not col or not rng_val or not (isinstance(rng_val, (list,tuple)) and len(rng_val)==2):
-                    continue
-                min_v, max_v = rng_val[0], rng_val[1]
-                num_series = pd.to_numeric(df_filtered[col], errors='coerce')
-                df_filtered = df_filtered[num_series.notna() & (num_series >= min_v) & (num_series <= max_v)]
-
-            elif filter_type == 'column_comparison':
-                c1, cnd, c2 = f_config.get('column1'), f_config.get('condition'), f_config.get('column2')
-                if not c1 or not c2: continue
-
-                s1_numeric = pd.to_numeric(df_filtered[c1], errors='coerce')
-                s2_numeric = pd.to_numeric(df_filtered[c2], errors='coerce')
-                valid_comparison_mask = s1_numeric.notna() & s2_numeric.notna()
-                
-                if not valid_comparison_mask.any(): 
-                    df_filtered = df_filtered.iloc[0:0] 
-                    continue
-
-                comparable_s1 = s1_numeric[valid_comparison_mask]
-                comparable_s2 = s2_numeric[valid_comparison_mask]
-                
-                if cnd == '>': result_mask = comparable_s1 > comparable_s2
-                elif cnd == '<': result_mask = comparable_s1 < comparable_s2
-                elif cnd == '>=': result_mask = comparable_s1 >= comparable_s2
-                elif cnd == '<=': result_mask = comparable_s1 <= comparable_s2
-                elif cnd == '==': result_mask = comparable_s1 == comparable_s2
-                elif cnd == '!=': result_mask = comparable_s1 != comparable_s2
-                else: 
-                    result_mask = pd.Series([False] * len(comparable_s1), index=comparable_s1.index)
-                
-                comparable_df_slice = df_filtered[valid_comparison_mask]
-                df_filtered = comparable_df_slice[result_mask]
-        
-        except Exception as e: 
-            # It's generally better to log errors or display a generic message in UI
-            # st.error might be too intrusive if many filters cause minor issues.
-            st.error(f"Erro ao aplicar filtro {i+1} (Tipo: {f_config.get('type')}, Col: {col or f_config.get('column1')}): {e}")
-            continue 
-            
-    return df_filtered
+            step_mask = shared_masks.get(step)
+        except Exception as e:
+            messages.append(('error', step.error_message(e)))
+            continue
+        t0 = time.perf_counter()
+        np.logical_and(mask, step_mask, out=mask)
+        shared_masks.add_busy_time(time.perf_counter() - t0)
+    shared_masks.release(plan.steps)
+    return mask, messages
+
+def _evaluate_sets(original_df, filter_sets, use_index, messages, max_workers, timings, finish, use_cache=True):
+    """Shared driver of count_filter_sets / evaluate_filter_set_bitmaps.
+    finish(mask) turns each set's mask into the value returned for it, inside
+    the worker, so masks that are not needed afterwards are released early.
+    Sets found in the result cache are not evaluated again."""
+    emit = messages is None
+    messages = [] if emit else messages
+    n_rows = 0 if original_df is None else len(original_df)
+    if original_df is None or original_df.empty:
+        return {name: finish(np.ones(n_rows, dtype=bool)) for name in filter_sets}
+
+    started = time.perf_counter()
+    keys = {name: result_cache_key(original_df, filters or []) if use_cache else None
+            for name, filters in filter_sets.items()}
+    cached = {name: get_cached_result(key) for name, key in keys.items()}
+    plans = {name: get_filter_plan(original_df, filters or [])
+             for name, filters in filter_sets.items() if cached[name] is None}
+    shared_masks = _SharedStepMasks(original_df, plans.values(), use_index)
+
+    def assemble(name):
+        mask, set_messages = _assemble_set_mask(n_rows, plans[name], shared_masks)
+        if keys[name] is not None:
+            store_result(keys[name], np.flatnonzero(mask), set_messages)
+        return finish(mask), set_messages
+
+    workers = max(1, min(int(max_workers or 1), len(plans)))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="filter-sets") as pool:
+            # map() yields in submission order, so results are deterministic
+            outcomes = dict(zip(plans, pool.map(assemble, plans)))
+    else:
+        outcomes = {name: assemble(name) for name in plans}
+
+    results = {}
+    for name in filter_sets:
+        if cached[name] is not None:
+            result, set_messages = finish(_rows_to_mask(n_rows, cached[name].positions)), cached[name].messages
+        else:
+            result, set_messages = outcomes[name]
+        results[name] = result
+        messages.extend(set_messages)
+
+    if timings is not None:
+        timings['wall_seconds'] = time.perf_counter() - started
+        # Work done by all threads together: roughly what a serial run would take
+        timings['serial_seconds'] = shared_masks.busy_seconds
+        timings['workers'] = workers
+    if emit:
+        _emit_messages(messages)
+    return results
+
+def count_filter_sets(original_df, filter_sets, return_positions=False, use_index=True,
+                      messages=None, max_workers=1, timings=None, use_cache=True):
+    """Evaluates several named filter sets at once, sharing identical predicates,
+    and returns only what the analysis table needs.
+
+    Every set is compiled (plans are cached); the distinct steps across all
+    plans are evaluated once each, and each set's mask is the AND of the masks
+    of its steps. Comparing N saved strategies therefore costs about the number
+    of distinct predicates, not the total number of filters.
+
+    Args:
+        original_df (pd.DataFrame): Data to filter. It is never copied or modified.
+        filter_sets (dict): {set name: filter list} in the named_filters.json shape.
+        messages (list, optional): Receives the (level, text) warnings/errors
+            instead of showing them, e.g. when running off the script thread.
+        max_workers (int, optional): Sets are spread over a thread pool of this
+            size (NumPy comparisons release the GIL). 1 (default) runs serially.
+        timings (dict, optional): Receives 'wall_seconds', 'serial_seconds'
+            (mask computation and combination time summed over all threads,
+            i.e. an estimate of the serial run time) and 'workers'.
+        use_cache (bool, optional): Reuse (and fill) the process-wide result
+            cache, so sets already evaluated on the same data are not recomputed.
+
+    Returns:
+        dict: {set name: row count}, or {set name: (row count, row positions)}
+        with return_positions=True, in the order of filter_sets. Masks are
+        dropped as soon as they are counted.
+    """
+    if return_positions:
+        def finish(mask):
+            positions = np.flatnonzero(mask)
+            return len(positions), positions
+    else:
+        def finish(mask):
+            return int(np.count_nonzero(mask))
+    return _evaluate_sets(original_df, filter_sets, use_index, messages, max_workers, timings, finish, use_cache)
+
+def evaluate_filter_set_bitmaps(original_df, filter_sets, use_index=True, messages=None, max_workers=1,
+                                timings=None, use_cache=True):
+    """Like count_filter_sets, but each set's result is a PackedBitmap (one
+    bit per row), compact enough to keep for hundreds of sets and to intersect
+    pairwise; see result_bitmaps.overlap_matrix.
+
+    Returns:
+        dict: {set name: PackedBitmap}, in the order of filter_sets.
+    """
+    return _evaluate_sets(original_df, filter_sets, use_index, messages, max_workers, timings,
+                          PackedBitmap.from_mask, use_cache)
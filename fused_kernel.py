@@ -0,0 +1,154 @@
+"""Fused, chunked evaluation of a whole compiled filter plan.
+
+Instead of producing one full-length temporary array per comparison, the plan
+is turned into a list of chunk kernels that all work on the same small,
+preallocated buffers. Rows are processed CHUNK_ROWS at a time and every
+predicate runs on a chunk before moving to the next one, so the data being
+compared stays in cache and temporary memory is bounded by the chunk size. A
+chunk whose rows are all rejected skips the remaining predicates.
+"""
+import numpy as np
+
+from dataset_cache import (
+    get_numeric_column,
+    get_value_index,
+    peek_step_mask,
+    supports_value_index
+)
+from filter_plan import (
+    COMPARISON_OPS,
+    ComparisonStep,
+    NumericValueStep,
+    RangeStep,
+    TextValueStep
+)
+
+CHUNK_ROWS = 64 * 1024 # 64 KB of booleans / 512 KB of float64 per input column
+
+
+def _and_into(out, tmp):
+    np.logical_and(out, tmp, out=out)
+
+
+def _numeric_value_kernel(df, step):
+    numeric = get_numeric_column(df, step.column)
+    values, nan_mask = numeric.values, numeric.nan_mask
+    ufunc, value = COMPARISON_OPS[step.op], step.value
+    drops_missing = step.drops_missing(df[step.column].dtype)
+
+    def kernel(start, stop, out, tmp):
+        ufunc(values[start:stop], value, out=tmp)
+        _and_into(out, tmp)
+        if drops_missing:
+            np.logical_not(nan_mask[start:stop], out=tmp)
+            _and_into(out, tmp)
+    return kernel
+
+
+def _range_kernel(df, step):
+    values = get_numeric_column(df, step.column).values
+    low, high = step.low, step.high
+
+    def kernel(start, stop, out, tmp):
+        chunk = values[start:stop]
+        np.greater_equal(chunk, low, out=tmp)
+        _and_into(out, tmp)
+        np.less_equal(chunk, high, out=tmp)
+        _and_into(out, tmp)
+    return kernel
+
+
+def _comparison_kernel(df, step):
+    if step.op not in COMPARISON_OPS:
+        def kernel(start, stop, out, tmp):
+            out[:] = False # unknown operator keeps no rows
+        return kernel
+
+    s1, s2 = get_numeric_column(df, step.column1), get_numeric_column(df, step.column2)
+    ufunc, check_nan = COMPARISON_OPS[step.op], step.op == '!='
+
+    def kernel(start, stop, out, tmp):
+        ufunc(s1.values[start:stop], s2.values[start:stop], out=tmp)
+        _and_into(out, tmp)
+        if check_nan: # NaN != x is True for numpy; non-comparable rows drop out
+            np.logical_not(s1.nan_mask[start:stop], out=tmp)
+            _and_into(out, tmp)
+            np.logical_not(s2.nan_mask[start:stop], out=tmp)
+            _and_into(out, tmp)
+    return kernel
+
+
+def _text_value_kernel(df, step):
+    index = get_value_index(df, step.column)
+    code = index.code_for(step.value)
+    code = -2 if code is None else code # -2 matches no row (missing rows are -1)
+    codes = index.codes
+    drop_missing = step.drops_missing(df[step.column].dtype)
+
+    def kernel(start, stop, out, tmp):
+        chunk = codes[start:stop]
+        if step.op == '==':
+            np.equal(chunk, code, out=tmp)
+            _and_into(out, tmp)
+            return
+        np.not_equal(chunk, code, out=tmp)
+        _and_into(out, tmp)
+        if drop_missing:
+            np.not_equal(chunk, -1, out=tmp)
+            _and_into(out, tmp)
+    return kernel
+
+
+def _mask_slice_kernel(mask):
+    def kernel(start, stop, out, tmp):
+        _and_into(out, mask[start:stop])
+    return kernel
+
+
+def compile_kernel(df, step):
+    """Chunk kernel for one step: kernel(start, stop, out, tmp) ANDs the step's
+    result for rows [start, stop) into out, using tmp as scratch space."""
+    cached_mask = peek_step_mask(df, step)
+    if cached_mask is not None:
+        return _mask_slice_kernel(cached_mask)
+    if isinstance(step, (NumericValueStep, RangeStep)) and not get_numeric_column(df, step.column).exact:
+        return _mask_slice_kernel(step.mask(df)) # compared on the column itself
+    if isinstance(step, NumericValueStep):
+        return _numeric_value_kernel(df, step)
+    if isinstance(step, RangeStep):
+        return _range_kernel(df, step)
+    if isinstance(step, ComparisonStep):
+        return _comparison_kernel(df, step)
+    if isinstance(step, TextValueStep) and supports_value_index(df[step.column].dtype):
+        return _text_value_kernel(df, step)
+    # Anything else (e.g. text comparison on datetime columns): precompute once
+    return _mask_slice_kernel(step.mask(df))
+
+
+def evaluate_fused(df, steps, messages=None, chunk_rows=CHUNK_ROWS):
+    """Boolean mask of the rows passing every step, computed chunk by chunk.
+
+    Steps whose kernel cannot be built (unknown column, ...) are skipped and
+    reported through `messages`, like the other evaluation paths.
+    """
+    kernels = []
+    for step in steps:
+        try:
+            kernels.append((step, compile_kernel(df, step)))
+        except Exception as e:
+            if messages is not None:
+                messages.append(('error', step.error_message(e)))
+
+    n_rows = len(df)
+    result = np.ones(n_rows, dtype=bool)
+    tmp_buffer = np.empty(min(chunk_rows, max(n_rows, 1)), dtype=bool)
+    # Kernels only run ufuncs on arrays prepared by compile_kernel, so anything
+    # that can fail (missing column, coercion) has already failed above.
+    for start in range(0, n_rows, chunk_rows):
+        stop = min(start + chunk_rows, n_rows)
+        out, tmp = result[start:stop], tmp_buffer[:stop - start]
+        for step, kernel in kernels:
+            kernel(start, stop, out, tmp)
+            if not out.any():
+                break # every row of this chunk is already rejected
+    return result
@@ -0,0 +1,129 @@
+"""Content-addressed on-disk cache of parsed uploads.
+
+Parsing a large XLSX/ODS through openpyxl/odfpy takes far longer than reading
+the same table back from Parquet. Every parsed sheet (or CSV) is therefore saved
+as a Parquet file named after the SHA-256 of the uploaded bytes, the sheet
+name, the reader's read options and PARSER_VERSION; uploading the same bytes
+again, in any session, reads the Parquet file back into a DataFrame (one
+columnar read and conversion, no cell-by-cell parsing) instead of parsing the
+workbook. The cache folder is limited to INGEST_CACHE_MAX_BYTES, evicting the
+least recently used files first.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import pyarrow.parquet as pq
+
+INGEST_CACHE_DIR = os.environ.get(
+    "INGEST_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ingest_cache"))
+INGEST_CACHE_MAX_BYTES = int(os.environ.get("INGEST_CACHE_MB", "2048")) * 1024 * 1024
+# Part of every cache key. Bump it whenever a reader change (data_loading,
+# spreadsheet_loading) can parse the same bytes into a different DataFrame:
+# files cached by the older readers are then never served again, and age out
+# through eviction. 2: per-column decimal mark detection for CSVs.
+PARSER_VERSION = 2
+
+_HASH_BLOCK_BYTES = 1024 * 1024
+_eviction_lock = threading.Lock()
+
+
+def file_content_hash(file):
+    """SHA-256 of a file-like object's bytes (read in 1 MB blocks, position restored to 0)."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for block in iter(lambda: file.read(_HASH_BLOCK_BYTES), b''):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def _cache_path(content_hash, sheet_name, read_options=None):
+    # Sheet names may contain any character: they are hashed into the file name,
+    # together with everything else that decides the parsed result
+    key = json.dumps([PARSER_VERSION, str(sheet_name or ''), read_options], sort_keys=True, default=str)
+    key_part = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(INGEST_CACHE_DIR, f"{content_hash}_{key_part}.parquet")
+
+
+def is_cached(content_hash, sheet_name, read_options=None):
+    """Whether the sheet (None for CSV) of the file with this hash is cached
+    for these read options."""
+    return os.path.exists(_cache_path(content_hash, sheet_name, read_options))
+
+
+def _read_cached(path):
+    table = pq.read_table(path)
+    os.utime(path) # mark as recently used for eviction
+    return table.to_pandas()
+
+
+def _write_cached(path, df):
+    os.makedirs(INGEST_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=INGEST_CACHE_DIR, suffix=".tmp")
+    os.close(fd)
+    try:
+        df.to_parquet(tmp_path, engine='pyarrow')
+        os.replace(tmp_path, path) # atomic: other sessions never see a partial file
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def evict_ingest_cache(max_bytes=None):
+    """Deletes the least recently used cached files until the folder fits in max_bytes."""
+    max_bytes = INGEST_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    with _eviction_lock:
+        entries = []
+        for name in os.listdir(INGEST_CACHE_DIR) if os.path.isdir(INGEST_CACHE_DIR) else []:
+            if not name.endswith(".parquet"):
+                continue
+            path = os.path.join(INGEST_CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def load_with_cache(file, sheet_name, parse, content_hash=None, read_options=None):
+    """Returns (DataFrame, from_cache) for one sheet of an uploaded file.
+
+    Args:
+        file: Uploaded file object (its bytes define the cache key).
+        sheet_name (str or None): Sheet to load; None for CSV files.
+        parse (callable): Parses the sheet when it is not cached, e.g.
+            lambda: pd.read_excel(xls, sheet_name=...).
+        content_hash (str, optional): file_content_hash(file), if already known.
+        read_options (dict, optional): JSON-serializable settings of the reader
+            that change its result for the same bytes (e.g. CSV_READ_OPTIONS).
+
+    Tables that Parquet cannot store (mixed-type object columns, non-text
+    column names, ...) are simply not cached.
+    """
+    content_hash = content_hash or file_content_hash(file)
+    path = _cache_path(content_hash, sheet_name, read_options)
+    if os.path.exists(path):
+        try:
+            return _read_cached(path), True
+        except Exception:
+            pass # unreadable (e.g. evicted meanwhile): parse again
+
+    df = parse()
+    try:
+        _write_cached(path, df)
+    except Exception:
+        return df, False
+    evict_ingest_cache()
+    return df, False
@@ -0,0 +1,168 @@
+"""Parallel ingestion of several uploads into one combined dataset.
+
+Data often arrives as one file per league or season. The files are parsed
+concurrently, their schemas are aligned and they are concatenated with a
+column naming the file each row came from.
+
+CSVs and cached workbooks are read on a thread pool: the Arrow CSV reader and
+the Parquet ingest cache spend most of their time outside the GIL. Workbooks
+that must be parsed go through openpyxl/the ODS reader, which are pure Python
+and hold the GIL, so they are parsed in worker processes instead; each worker
+returns the parsed DataFrame (pickled) and fills the ingest cache on the way.
+"""
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from data_loading import CSV_READ_OPTIONS, read_csv_fast
+from ingest_cache import file_content_hash, is_cached, load_with_cache
+from spreadsheet_loading import list_sheet_names, load_sheet
+
+SOURCE_COLUMN = "Arquivo de Origem"
+DEFAULT_INGEST_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def parse_upload(file):
+    """Parses one upload (CSV, or the first sheet of an XLSX/ODS) through the
+    ingest cache. Returns (DataFrame, info) with 'seconds' and 'engine'."""
+    started = time.perf_counter()
+    info = {}
+    extension = file.name.split('.')[-1].lower()
+    if extension == "csv":
+        df, from_cache = load_with_cache(file, None, lambda: read_csv_fast(file, info),
+                                         read_options=CSV_READ_OPTIONS)
+    elif extension in ("xlsx", "ods"):
+        first_sheet = list_sheet_names(file, extension)[0]
+        df, from_cache = load_sheet(file, extension, first_sheet)
+        info['engine'] = 'openpyxl' if extension == "xlsx" else 'odf (streaming)'
+    else:
+        raise ValueError(f"formato não suportado: .{extension}")
+    info['engine'] = 'cache parquet' if from_cache else info.get('engine', 'pandas')
+    info['seconds'] = time.perf_counter() - started
+    return df, info
+
+
+def _parse_workbook_bytes(name, data):
+    # Runs in a worker process: the upload object itself cannot be sent there
+    file = io.BytesIO(data)
+    file.name = name
+    return parse_upload(file)
+
+
+def _needs_process(file):
+    """Whether parsing the upload runs openpyxl/the ODS reader (GIL-bound)
+    rather than the Arrow CSV reader or the ingest cache."""
+    extension = file.name.split('.')[-1].lower()
+    if extension not in ("xlsx", "ods"):
+        return False
+    return not is_cached(file_content_hash(file), list_sheet_names(file, extension)[0])
+
+
+def _reconcile_column(columns_by_source):
+    """Converts the pieces of one column to a dtype they can be concatenated
+    in without turning numbers into text: text pieces whose every value parses
+    as a number are converted when the other pieces are numeric."""
+    dtypes = {str(series.dtype) for series in columns_by_source.values()}
+    if len(dtypes) <= 1:
+        return columns_by_source, None
+    numeric = [name for name, s in columns_by_source.items()
+               if pd.api.types.is_numeric_dtype(s.dtype) and not pd.api.types.is_bool_dtype(s.dtype)]
+    reconciled = dict(columns_by_source)
+    if numeric:
+        for name, series in columns_by_source.items():
+            if name in numeric or not pd.api.types.is_object_dtype(series.dtype):
+                continue
+            converted = pd.to_numeric(series, errors='coerce')
+            if converted.notna().sum() == series.notna().sum():
+                reconciled[name] = converted
+    for name, series in reconciled.items():
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Different category sets cannot be concatenated as categories
+            reconciled[name] = series.astype(object)
+    return reconciled, sorted(dtypes)
+
+
+def align_and_concat(frames, source_column=SOURCE_COLUMN):
+    """Concatenates {source name: DataFrame} into one DataFrame.
+
+    The result has the union of the columns (in first-seen order) plus
+    source_column; rows of files missing a column get missing values there.
+    Returns (DataFrame, report) where report has 'missing_columns' ({source:
+    [columns]}) and 'reconciled' ({column: [dtypes found]}).
+    """
+    columns = []
+    for df in frames.values():
+        columns.extend(c for c in df.columns if c not in columns)
+    while source_column in columns:
+        source_column += "_"
+
+    reconciled_report = {}
+    pieces = {name: df.copy(deep=False) for name, df in frames.items()}
+    for column in columns:
+        present = {name: df[column] for name, df in pieces.items() if column in df.columns}
+        reconciled, found_dtypes = _reconcile_column(present)
+        if found_dtypes:
+            reconciled_report[column] = found_dtypes
+            for name, series in reconciled.items():
+                pieces[name][column] = series
+
+    for name, df in pieces.items():
+        df[source_column] = name
+    combined = pd.concat(list(pieces.values()), ignore_index=True, sort=False)
+    combined = combined[columns + [source_column]]
+    combined[source_column] = combined[source_column].astype('category')
+    missing = {name: [c for c in columns if c not in df.columns] for name, df in frames.items()}
+    return combined, {'missing_columns': {k: v for k, v in missing.items() if v},
+                      'reconciled': reconciled_report}
+
+
+def load_files_parallel(files, max_workers=DEFAULT_INGEST_WORKERS):
+    """Parses the uploads concurrently and combines them (see align_and_concat).
+
+    Workbooks to parse are spread over up to max_workers worker processes when
+    that gives at least two of them (otherwise they are parsed on the threads,
+    which avoids starting a process); everything else runs on up to
+    max_workers threads.
+
+    Returns (DataFrame, info): 'seconds' (wall time), 'serial_seconds' (sum of
+    the per-file parse times), 'per_file' ({name: (seconds, engine)}),
+    'workers', 'processes', 'engine' and the align_and_concat report under 'schema'.
+    """
+    started = time.perf_counter()
+    workers = max(1, min(int(max_workers or 1), len(files)))
+    in_process = [_needs_process(file) for file in files]
+    processes = min(workers, sum(in_process))
+    processes = processes if processes > 1 else 0 # a single worker would parse no faster
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest") as threads:
+        # spawn, not fork: the app process runs the Streamlit server's threads
+        process_pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) \
+            if processes else None
+        try:
+            futures = [process_pool.submit(_parse_workbook_bytes, file.name, file.getvalue())
+                       if process_pool is not None and parse_elsewhere else threads.submit(parse_upload, file)
+                       for file, parse_elsewhere in zip(files, in_process)]
+            results = [future.result() for future in futures] # upload order
+        finally:
+            if process_pool is not None:
+                process_pool.shutdown(cancel_futures=True)
+
+    frames, per_file = {}, {}
+    for file, (df, file_info) in zip(files, results):
+        name = file.name
+        while name in frames: # same file name uploaded twice
+            name += "_"
+        frames[name] = df
+        per_file[name] = (file_info['seconds'], file_info['engine'])
+    combined, schema_report = align_and_concat(frames)
+    return combined, {
+        'seconds': time.perf_counter() - started,
+        'serial_seconds': sum(seconds for seconds, _ in per_file.values()),
+        'per_file': per_file, 'workers': workers, 'processes': processes,
+        'engine': f"{len(files)} arquivos, {workers} thread(s)"
+                  + (f", {processes} processo(s)" if processes else ""),
+        'schema': schema_report,
+    }
@@ -1,6 +1,8 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import sys
+import os
 from streamlit_cookies_manager import EncryptedCookieManager # Importar
 import datetime # Para timedelta, embora não usado diretamente aqui, mas relacionado
 
@@ -8,8 +10,12 @@ import datetime # Para timedelta, embora não usado diretamente aqui, mas relaci
 sys.path.append('..') 
 
 from state_helpers import load_all_filter_sets 
-from ui_controls import display_file_uploader
-from filter_processing import apply_filters_to_dataframe
+from ui_controls import display_export_controls, display_file_uploader, make_stream_progress
+from filter_processing import DEFAULT_SET_WORKERS, evaluate_filter_set_bitmaps
+from data_loading import stream_count_filter_sets
+from result_cache import result_cache_stats
+from result_bitmaps import overlap_frames
+from dataset_registry import registry_stats
 
 # --- Configuração do Cookie Manager ---
 try:
@@ -36,6 +42,34 @@ def restore_session_from_cookie_analysis_page():
             st.session_state.logged_in = True
             st.session_state.username = username_from_cookie
 
+def display_overlap_matrix(set_bitmaps):
+    """N x N overlap between the analyzed sets: shared rows or Jaccard index."""
+    st.subheader("Sobreposição entre os Filtros")
+    intersections_df, jaccard_df = overlap_frames(set_bitmaps)
+    metric = st.radio(
+        "Métrica", ["Jaccard", "Linhas em comum"], horizontal=True, key="analysis_overlap_metric",
+        help="Jaccard = linhas em comum / linhas em pelo menos um dos dois filtros (1 = mesmas linhas, 0 = nenhuma em comum)."
+    )
+    if metric == "Jaccard":
+        column_config = {name: st.column_config.ProgressColumn(name, min_value=0.0, max_value=1.0, format="%.2f")
+                         for name in jaccard_df.columns}
+        st.dataframe(jaccard_df, use_container_width=True, column_config=column_config)
+    else:
+        st.dataframe(intersections_df, use_container_width=True)
+    st.caption("Diagonal: total de linhas de cada filtro. Valores altos fora da diagonal indicam estratégias pouco diversificadas.")
+
+def display_analysis_exports(current_df, results_df, set_bitmaps):
+    """Export of the analysis table and of the rows matched by one analyzed set."""
+    with st.expander("📥 Exportar", expanded=False):
+        st.markdown("**Tabela da análise**")
+        display_export_controls(results_df, np.arange(len(results_df)), tuple(results_df.itertuples(index=False)),
+                                key="analysis_table", file_stem="analise_filtros")
+        if set_bitmaps: # row positions are only kept for in-memory datasets
+            st.markdown("**Linhas de um filtro**")
+            set_name = st.selectbox("Filtro", list(set_bitmaps), key="analysis_export_set")
+            display_export_controls(current_df, set_bitmaps[set_name].positions(), set_name,
+                                    key="analysis_set_rows", file_stem=f"linhas_{set_name}")
+
 def run_analysis_page():
     restore_session_from_cookie_analysis_page() # Tenta restaurar sessão no início
 
@@ -58,6 +92,16 @@ def run_analysis_page():
         st.header("Carregar Dados para Análise")
         # Ensure this key is DIFFERENT from the default key used in app.py
         display_file_uploader(uploader_key="analysis_page_uploader") 
+        st.divider()
+        st.header("Desempenho")
+        max_workers = st.number_input(
+            "Threads para avaliar os conjuntos", min_value=1, max_value=max(os.cpu_count() or 1, 1) * 2,
+            value=DEFAULT_SET_WORKERS, step=1, key="analysis_max_workers",
+            help="Conjuntos de filtros são avaliados em paralelo nesta quantidade de threads. Use 1 para execução serial."
+        )
+        shared = registry_stats()
+        st.caption(f"Datasets em memória no servidor: {shared['datasets']} "
+                   f"({shared['bytes'] / 1024**2:.1f} MB), compartilhados por {shared['handles']} sessão(ões).")
 
     current_df = st.session_state.get('df')
 
@@ -82,20 +126,49 @@ def run_analysis_page():
             st.subheader("Resultados da Análise")
 
             results_data = []
-            # Use a fresh copy of the original DataFrame for each filter analysis
-            df_for_analysis = current_df.copy() 
-
-            for name in selected_filter_names:
-                filter_config = all_saved_filters.get(name)
-                if filter_config:
-                    # Apply this specific filter set
-                    df_filtered_for_this_analysis = apply_filters_to_dataframe(df_for_analysis, filter_config)
-                    line_count = len(df_filtered_for_this_analysis)
-                    results_data.append({"Nome do Filtro": name, "Quantidade de Jogos (Linhas)": line_count})
+            # All selected sets are evaluated together: predicates shared between
+            # sets (e.g. the same odds range) are computed only once.
+            sets_to_analyze = {name: all_saved_filters[name] for name in selected_filter_names if all_saved_filters.get(name)}
+            timings = {}
+            set_bitmaps = None
+            stream_source = st.session_state.get('stream_source')
+            if stream_source is not None:
+                # Streamed dataset: counts are accumulated chunk by chunk over the whole file
+                progress_bar = st.progress(0.0, text="Lendo o arquivo em blocos...")
+                messages = []
+                set_counts, total_rows = stream_count_filter_sets(
+                    stream_source, sets_to_analyze, messages,
+                    progress=make_stream_progress(progress_bar), max_workers=max_workers)
+                progress_bar.empty()
+                for level, text in messages:
+                    (st.error if level == 'error' else st.warning)(text)
+                st.caption(f"📡 Dataset em streaming `{stream_source['name']}`: {total_rows} linhas lidas.")
+            else:
+                # Results are kept as packed bitmaps (1 bit per row): counts and the
+                # overlap matrix come from popcounts, no filtered DataFrame is built
+                set_bitmaps = evaluate_filter_set_bitmaps(current_df, sets_to_analyze,
+                                                          max_workers=max_workers, timings=timings)
+                set_counts = {name: bitmap.count() for name, bitmap in set_bitmaps.items()}
+
+            for name, line_count in set_counts.items():
+                results_data.append({"Nome do Filtro": name, "Quantidade de Jogos (Linhas)": line_count})
             
             if results_data:
                 results_df = pd.DataFrame(results_data)
                 st.dataframe(results_df, use_container_width=True)
+                if timings:
+                    saved = max(timings['serial_seconds'] - timings['wall_seconds'], 0.0)
+                    st.caption(f"Tempo de avaliação: {timings['wall_seconds']:.2f}s com {timings['workers']} thread(s) | "
+                               f"Estimativa serial: {timings['serial_seconds']:.2f}s | Economia do paralelismo: {saved:.2f}s")
+                cache_stats = result_cache_stats()
+                st.caption(f"Cache de resultados (compartilhado entre sessões): {cache_stats['hits']} acertos | "
+                           f"{cache_stats['misses']} falhas | {cache_stats['entries']} resultados em "
+                           f"{cache_stats['bytes'] / 1024**2:.1f} de {cache_stats['max_bytes'] / 1024**2:.0f} MB")
+                if set_bitmaps is not None and len(set_bitmaps) > 1:
+                    display_overlap_matrix(set_bitmaps)
+                elif stream_source is not None and len(set_counts) > 1:
+                    st.info("A matriz de sobreposição não está disponível para datasets em streaming.")
+                display_analysis_exports(current_df, results_df, set_bitmaps)
             else:
                 # This case might occur if selected_filter_names is not empty but all_saved_filters.get(name) fails for all.
                 st.info("Não foi possível aplicar os filtros selecionados ou os filtros não produziram resultados.")
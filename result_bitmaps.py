@@ -0,0 +1,122 @@
+"""Compact, packed-bit storage of filter results and set-overlap statistics.
+
+A result over n rows is kept as ceil(n / 64) uint64 words (one bit per row, 8x
+smaller than a boolean mask and 64x smaller than int64 row positions).
+Intersections, unions and differences between results are word-wise bit
+operations, and counting rows is a popcount (np.bitwise_count) per word, so
+comparing many saved sets never goes back to the DataFrame.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# Words processed at a time by overlap_matrix: 4096 words = 32 KB per set, so
+# the block of every set stays in cache while all pairs are counted.
+OVERLAP_BLOCK_WORDS = 4096
+
+
+def _pack(mask):
+    bits = np.packbits(np.asarray(mask, dtype=bool), bitorder='little')
+    padding = -len(bits) % 8
+    if padding:
+        bits = np.concatenate([bits, np.zeros(padding, dtype=np.uint8)])
+    words = bits.view(np.uint64)
+    words.setflags(write=False)
+    return words
+
+
+@dataclass(frozen=True)
+class PackedBitmap:
+    """Rows passing a filter set, one bit per row. Bits past n_rows are zero."""
+    words: np.ndarray
+    n_rows: int
+
+    @classmethod
+    def from_mask(cls, mask):
+        return cls(words=_pack(mask), n_rows=len(mask))
+
+    @classmethod
+    def from_positions(cls, n_rows, positions):
+        mask = np.zeros(n_rows, dtype=bool)
+        mask[positions] = True
+        return cls.from_mask(mask)
+
+    @property
+    def nbytes(self):
+        return self.words.nbytes
+
+    def count(self):
+        return int(np.bitwise_count(self.words).sum(dtype=np.int64))
+
+    def to_mask(self):
+        bits = np.unpackbits(self.words.view(np.uint8), count=self.n_rows, bitorder='little')
+        return bits.view(bool)
+
+    def positions(self):
+        return np.flatnonzero(self.to_mask())
+
+    def _combine(self, other, ufunc):
+        if self.n_rows != other.n_rows:
+            raise ValueError(f"bitmaps de tamanhos diferentes: {self.n_rows} e {other.n_rows} linhas")
+        words = ufunc(self.words, other.words)
+        words.setflags(write=False)
+        return PackedBitmap(words=words, n_rows=self.n_rows)
+
+    def __and__(self, other):
+        return self._combine(other, np.bitwise_and)
+
+    def __or__(self, other):
+        return self._combine(other, np.bitwise_or)
+
+    def __xor__(self, other):
+        return self._combine(other, np.bitwise_xor)
+
+    def intersection_count(self, other):
+        """Rows in both bitmaps, without keeping the combined bitmap."""
+        return (self & other).count()
+
+
+def overlap_matrix(bitmaps, block_words=OVERLAP_BLOCK_WORDS):
+    """N x N int64 matrix of pairwise intersection counts (the diagonal holds
+    each bitmap's own count).
+
+    The words are walked in blocks; within a block, row i of the stacked
+    bitmaps is ANDed with rows i..N-1 in one vectorized operation, so the cost is
+    N*(N+1)/2 popcounts of n/64 words with N Python calls per block.
+    """
+    n_sets = len(bitmaps)
+    counts = np.zeros((n_sets, n_sets), dtype=np.int64)
+    if n_sets == 0:
+        return counts
+    n_rows = bitmaps[0].n_rows
+    if any(b.n_rows != n_rows for b in bitmaps):
+        raise ValueError("todos os bitmaps devem ter o mesmo número de linhas")
+
+    stacked = np.stack([b.words for b in bitmaps]) # N x words
+    for start in range(0, stacked.shape[1], block_words):
+        block = stacked[:, start:start + block_words]
+        for i in range(n_sets):
+            anded = np.bitwise_and(block[i], block[i:])
+            counts[i, i:] += np.bitwise_count(anded).sum(axis=1, dtype=np.int64)
+    upper = np.triu_indices(n_sets, k=1)
+    counts[upper[1], upper[0]] = counts[upper]
+    return counts
+
+
+def jaccard_matrix(intersections):
+    """Jaccard index |A and B| / |A or B| from an overlap_matrix result
+    (1.0 for two empty sets, as they are identical)."""
+    sizes = np.diag(intersections).astype(np.float64)
+    unions = sizes[:, None] + sizes[None, :] - intersections
+    with np.errstate(invalid='ignore', divide='ignore'):
+        jaccard = np.where(unions > 0, intersections / unions, 1.0)
+    return jaccard
+
+
+def overlap_frames(bitmaps_by_name):
+    """(intersection DataFrame, Jaccard DataFrame) indexed and labelled by set name."""
+    names = list(bitmaps_by_name)
+    intersections = overlap_matrix([bitmaps_by_name[name] for name in names])
+    return (pd.DataFrame(intersections, index=names, columns=names),
+            pd.DataFrame(jaccard_matrix(intersections), index=names, columns=names))
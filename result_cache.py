@@ -0,0 +1,121 @@
+"""Process-wide cache of filter results, shared by every Streamlit session.
+
+Results are keyed by the content hash of the dataset plus the canonical JSON of
+the filter list, so two analysts who load the same export and run the same saved
+set share one computation even though each session has its own DataFrame
+object. Each entry stores the matching row positions and the messages the
+evaluation produced; entries are evicted least-recently-used first once the
+RESULT_CACHE_BYTES budget is exceeded.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from dataset_cache import get_content_hash
+from filter_plan import canonical_filters_json
+
+# Memory budget for cached results (row positions), configurable through the
+# RESULT_CACHE_MB environment variable.
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_MB", "256")) * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class CachedResult:
+    """Row positions (read-only, ascending) passing a filter list, the
+    (level, text) messages of the evaluation and, when it was requested, the
+    planner report."""
+    positions: np.ndarray
+    messages: tuple
+    report: tuple = None
+
+    @property
+    def nbytes(self):
+        return self.positions.nbytes
+
+
+class ResultCache:
+    """Thread-safe LRU of CachedResult entries with a byte budget."""
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, need_report=False):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (need_report and entry.report is None):
+                self.misses += 1 # without its report the result is computed again
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if entry.nbytes > self.max_bytes:
+            return # larger than the whole budget: never cached
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_result_cache = ResultCache()
+
+
+def result_cache_key(df, active_filters):
+    """Cache key for active_filters on df, or None if df's content cannot be hashed."""
+    content_hash = get_content_hash(df)
+    if content_hash is None:
+        return None
+    text = content_hash + '|' + canonical_filters_json(active_filters)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def get_cached_result(key, need_report=False):
+    """The CachedResult stored under key (counted as a hit), or None (a miss).
+    With need_report, an entry stored without a planner report is a miss."""
+    if key is None:
+        return None
+    return _result_cache.get(key, need_report)
+
+
+def store_result(key, positions, messages, report=None):
+    """Caches the row positions of a result; returns the stored (read-only) positions."""
+    positions = np.asarray(positions)
+    if positions.dtype == np.int64 and (len(positions) == 0 or positions[-1] < 2**31):
+        positions = positions.astype(np.int32) # positions are ascending: the last is the largest
+    positions.setflags(write=False)
+    if key is not None:
+        _result_cache.put(key, CachedResult(
+            positions=positions, messages=tuple(messages),
+            report=tuple(report) if report is not None else None))
+    return positions
+
+
+def result_cache_stats():
+    """Entries, bytes, hits, misses, evictions and hit rate of the shared cache."""
+    return _result_cache.stats()
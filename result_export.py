@@ -0,0 +1,143 @@
+"""Export of filter results to CSV, Parquet and XLSX files.
+
+Rows are given as positions into the loaded DataFrame (the output of the filter
+engine or of the result grid's sort) and are written in chunks of
+EXPORT_CHUNK_ROWS: only one chunk is materialized at a time, whatever the size
+of the result. Parquet files get one row group per chunk and XLSX workbooks are
+written with openpyxl's write-only mode, which streams rows to the file instead
+of keeping every cell in memory.
+"""
+import csv
+import os
+import tempfile
+import weakref
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+EXPORT_CHUNK_ROWS = 50_000
+# Rows per XLSX sheet, header included (Excel's limit); longer results continue on new sheets
+XLSX_MAX_ROWS = 1_048_576
+
+# Format name shown in the UI -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'XLSX': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ExportFile:
+    """A temporary file holding one export.
+
+    The file is deleted by release(), or when the object is garbage collected,
+    e.g. together with the session state that keeps it, so exports do not
+    outlive their session. Releasing twice has no effect.
+    """
+
+    def __init__(self, extension, file_name, mime, signature=None):
+        fd, self.path = tempfile.mkstemp(prefix="export_", suffix=f".{extension}")
+        os.close(fd)
+        self.file_name = file_name
+        self.mime = mime
+        self.signature = signature
+        self._finalizer = weakref.finalize(self, _remove_file, self.path)
+
+    def release(self):
+        self._finalizer()
+
+
+def _iter_chunks(df, positions, columns):
+    for start in range(0, len(positions), EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[positions[start:start + EXPORT_CHUNK_ROWS]]
+        yield chunk if columns is None else chunk[columns]
+
+
+def _write_csv(path, chunks, columns):
+    # utf-8-sig: spreadsheet programs then read the accents correctly
+    with open(path, 'w', encoding='utf-8-sig', newline='') as out:
+        csv.writer(out).writerow(columns)
+        for chunk in chunks:
+            chunk.to_csv(out, header=False, index=False)
+            yield len(chunk)
+
+
+def _parquet_schema(df, positions, columns):
+    # Inferred from the first chunk; columns with no value there are written as text
+    first = df.iloc[positions[:EXPORT_CHUNK_ROWS]]
+    schema = pa.Schema.from_pandas(first if columns is None else first[columns], preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+
+def _write_parquet(path, chunks, schema):
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield len(chunk)
+
+
+def _write_xlsx(path, chunks, columns):
+    workbook = Workbook(write_only=True)
+    header = [str(column) for column in columns]
+    sheet, sheet_rows = None, XLSX_MAX_ROWS
+    for chunk in chunks:
+        # Python objects with None for missing values, which openpyxl writes as empty cells
+        values = chunk.astype(object).where(chunk.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            if sheet_rows == XLSX_MAX_ROWS:
+                sheet = workbook.create_sheet(f"Dados {len(workbook.worksheets) + 1}" if workbook.worksheets else "Dados")
+                sheet.append(header)
+                sheet_rows = 1
+            sheet.append(row)
+            sheet_rows += 1
+        yield len(chunk)
+    if sheet is None: # no rows: header only
+        workbook.create_sheet("Dados").append(header)
+    workbook.save(path)
+
+
+def export_rows(df, positions, export_format, path, columns=None, progress=None):
+    """Writes the rows of df at positions, in that order, to path.
+
+    Args:
+        df (pd.DataFrame): The loaded dataset.
+        positions (np.ndarray): Row positions (iloc) to export.
+        export_format (str): A key of EXPORT_FORMATS.
+        path (str): File to create (overwritten if it exists).
+        columns (list, optional): Columns to export, in order; all by default.
+        progress (callable, optional): progress(rows_written, fraction), called
+            after every chunk.
+
+    Returns the number of rows written.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"formato deve ser um de {list(EXPORT_FORMATS)}, recebido '{export_format}'")
+    positions = np.asarray(positions)
+    columns = None if columns is None else list(columns)
+    header = list(df.columns) if columns is None else columns
+    chunks = _iter_chunks(df, positions, columns)
+    if export_format == 'CSV':
+        written_chunks = _write_csv(path, chunks, header)
+    elif export_format == 'Parquet':
+        written_chunks = _write_parquet(path, chunks, _parquet_schema(df, positions, columns))
+    else:
+        written_chunks = _write_xlsx(path, chunks, header)
+
+    rows_written = 0
+    for n_rows in written_chunks:
+        rows_written += n_rows
+        if progress is not None:
+            progress(rows_written, rows_written / max(len(positions), 1))
+    return rows_written
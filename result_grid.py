@@ -0,0 +1,73 @@
+"""Paged view of filter results.
+
+The filter engine returns the row positions that pass the filters; the result
+grid only ever materializes one page of them (DataFrame.iloc on the positions of
+the page), so the rows serialized and sent to the browser per rerun do not
+depend on the size of the dataset or of the result. Sorting is done on the
+server, over the positions, with the per-dataset sort and value indexes.
+"""
+import numpy as np
+import pandas as pd
+
+from dataset_cache import (
+    get_numeric_column,
+    get_sort_index,
+    get_value_index,
+    get_value_ranks,
+    supports_value_index
+)
+
+PAGE_SIZES = (50, 100, 250, 500, 1000)
+
+
+def _sorted_by_index(df, positions, column, ascending):
+    # Walk the column's global sort order keeping the result's rows: O(rows of
+    # the dataset), with no comparison sort whatever the size of the result.
+    index = get_sort_index(df, column)
+    in_result = np.zeros(len(df), dtype=bool)
+    in_result[positions] = True
+    valid = index.order[:index.valid_count]
+    kept = in_result[valid]
+    ordered = valid[kept]
+    if not ascending and len(ordered):
+        # Reverse the runs of equal values, keeping each run in row order (stable)
+        values = index.sorted_values[:index.valid_count][kept]
+        run_ids = np.cumsum(np.concatenate([[False], values[1:] != values[:-1]]))
+        ordered = ordered[np.argsort(-run_ids, kind='stable')]
+    missing = index.order[index.valid_count:]
+    return np.concatenate([ordered, missing[in_result[missing]]]) # missing values last either way
+
+
+def _sorted_by_value_rank(df, positions, column, ascending):
+    ranks = get_value_ranks(df, column)
+    keys = ranks[get_value_index(df, column).codes[positions]]
+    if not ascending:
+        keys = np.where(keys == len(ranks) - 1, keys, len(ranks) - 2 - keys) # missing values stay last
+    return positions[np.argsort(keys, kind='stable')]
+
+
+def sort_positions(df, positions, column, ascending=True):
+    """Row positions reordered by df[column] (stable, missing values last).
+
+    Numeric columns use their SortIndex (when exact, see NumericColumn) and text
+    columns their ValueIndex codes ranked in text order; other columns are
+    sorted by pandas.
+    """
+    positions = np.asarray(positions)
+    dtype = df[column].dtype
+    if (pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+            and get_numeric_column(df, column).exact):
+        return _sorted_by_index(df, positions, column, ascending)
+    if supports_value_index(dtype):
+        return _sorted_by_value_rank(df, positions, column, ascending)
+    values = df[column].iloc[positions].reset_index(drop=True)
+    order = values.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+    return positions[order]
+
+
+def grid_page(df, positions, page, page_size, columns=None):
+    """DataFrame with the rows of page (1-based) of positions, and only the
+    given columns (all when None). Row labels are those of df."""
+    start = (page - 1) * page_size
+    page_rows = df.iloc[positions[start:start + page_size]]
+    return page_rows if columns is None else page_rows[list(columns)]
@@ -0,0 +1,273 @@
+"""Lazy loading of XLSX/ODS workbooks.
+
+pd.ExcelFile loads the whole workbook (shared strings for XLSX, the complete
+document tree for ODS) just to list its sheets. Here the sheet names come from
+the workbook metadata only, and a sheet is parsed on its own when selected:
+
+- XLSX: names from xl/workbook.xml; rows are streamed by openpyxl in read-only
+  mode (what pd.read_excel does when given the file instead of an ExcelFile).
+- ODS: the format keeps no sheet list outside content.xml, so the names come
+  from a byte-level scan of content.xml for the table tags (the cells are
+  never parsed); rows are streamed from content.xml with iterparse, stopping
+  at the end of the selected sheet, instead of building the odfpy DOM.
+
+prefetch_sheets parses the other sheets in a background thread into the
+Parquet ingest cache, so switching sheets afterwards is a cache read.
+"""
+import html
+import io
+import re
+import threading
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+
+from ingest_cache import file_content_hash, load_with_cache
+
+_XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_TABLE_NS = "{urn:oasis:names:tc:opendocument:xmlns:table:1.0}"
+_OFFICE_NS = "{urn:oasis:names:tc:opendocument:xmlns:office:1.0}"
+_TEXT_NS = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+
+_ODS_TABLE = _TABLE_NS + "table"
+_ODS_ROW = _TABLE_NS + "table-row"
+_ODS_CELL = _TABLE_NS + "table-cell"
+_ODS_COVERED_CELL = _TABLE_NS + "covered-table-cell"
+_ODS_TEXT_S = _TEXT_NS + "s"
+_ODS_ANNOTATION = _OFFICE_NS + "annotation"
+_ODS_SCAN_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+def list_sheet_names(file, extension):
+    """Sheet names of an XLSX/ODS file, in workbook order, without parsing any cell."""
+    file.seek(0)
+    with zipfile.ZipFile(file) as archive:
+        if extension == "xlsx":
+            with archive.open("xl/workbook.xml") as workbook:
+                return [sheet.get("name") for sheet in ET.parse(workbook).getroot().iter(_XLSX_NS + "sheet")]
+        with archive.open("content.xml") as content:
+            return _ods_sheet_names(content)
+
+
+def _ods_sheet_names(content):
+    # The table start/end tags are found by a regex over the raw bytes, read in
+    # blocks: no XML tokenizing of the cells at all. The prefix bound to the
+    # table namespace comes from the root element; without one (a default
+    # namespace, never written by office suites) the tables are iterparsed.
+    block = content.read(_ODS_SCAN_BLOCK_BYTES)
+    prefix = re.search(rb'xmlns:([\w.-]+)="' + re.escape(_TABLE_NS[1:-1].encode()) + rb'"', block)
+    if prefix is None:
+        return [name for name, _ in _iter_ods_tables(io.BytesIO(block + content.read()), wanted=None)]
+    prefix = re.escape(prefix.group(1))
+    tag_re = re.compile(rb"<(/?)" + prefix + rb""":table(?=[\s/>])((?:[^>"']|"[^"]*"|'[^']*')*)>""")
+    name_re = re.compile(rb"\s" + prefix + rb""":name\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+    names, depth, pending = [], 0, b""
+    while block:
+        data = pending + block
+        end = data.rfind(b"<") # a tag may continue in the next block
+        data, pending = (data[:end], data[end:]) if end >= 0 else (data, b"")
+        for match in tag_re.finditer(data):
+            closing, attributes = match.groups()
+            if closing:
+                depth -= 1
+                continue
+            if depth == 0: # nested tables are not sheets
+                name = name_re.search(attributes)
+                names.append(html.unescape((name.group(1) or name.group(2) or b"").decode("utf-8")) if name else None)
+            if not attributes.endswith(b"/"):
+                depth += 1
+        block = content.read(_ODS_SCAN_BLOCK_BYTES)
+    return names
+
+
+def _iter_ods_tables(content, wanted, row_limit=None):
+    """Yields (sheet name, rows) for each top-level table of content.xml.
+
+    rows is a list of row elements for the table named `wanted` and None for
+    the others. Rows are detached from the tree as soon as they end, so memory
+    stays proportional to the rows kept, and parsing stops after `wanted` (or
+    after its first row_limit rows).
+    """
+    stack, depth, current, rows = [], 0, None, None
+    for event, elem in ET.iterparse(content, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            if elem.tag == _ODS_TABLE:
+                depth += 1
+                if depth == 1:
+                    current = elem.get(_TABLE_NS + "name")
+                    rows = [] if current == wanted else None
+            continue
+        stack.pop()
+        if elem.tag == _ODS_TABLE:
+            depth -= 1
+            if depth == 0:
+                yield current, rows
+                if wanted is not None and current == wanted:
+                    return
+                stack[-1].remove(elem)
+        elif elem.tag == _ODS_ROW and depth == 1:
+            if rows is not None:
+                rows.append(elem)
+                if row_limit is not None and len(rows) >= row_limit:
+                    yield current, rows
+                    return
+            stack[-1].remove(elem) # detach: only the kept rows stay alive
+
+
+def _ods_string(elem):
+    # Same text as pandas' odf reader: <text:s c="n"/> are n spaces, notes are skipped
+    parts = [elem.text.strip("\n")] if elem.text else []
+    for child in elem:
+        if child.tag == _ODS_TEXT_S:
+            parts.append(" " * int(child.get(_TEXT_NS + "c", 1)))
+        elif child.tag != _ODS_ANNOTATION:
+            parts.append(_ods_string(child))
+        if child.tail:
+            parts.append(child.tail.strip("\n"))
+    return "".join(parts)
+
+
+def _ods_cell_value(cell):
+    """Cell value converted exactly as pandas' odf reader does ('' = empty)."""
+    text = "".join(cell.itertext())
+    if text == "#N/A":
+        return np.nan
+    cell_type = cell.get(_OFFICE_NS + "value-type")
+    if cell_type is None:
+        return ""
+    if cell_type == "boolean":
+        return text == "TRUE"
+    if cell_type == "float":
+        value = float(cell.get(_OFFICE_NS + "value"))
+        return int(value) if int(value) == value else value
+    if cell_type in ("percentage", "currency"):
+        return float(cell.get(_OFFICE_NS + "value"))
+    if cell_type == "string":
+        return _ods_string(cell)
+    if cell_type == "date":
+        return pd.Timestamp(cell.get(_OFFICE_NS + "date-value"))
+    if cell_type == "time":
+        return pd.Timestamp(text).time()
+    raise ValueError(f"Tipo de célula desconhecido: {cell_type}")
+
+
+def _ods_rows_to_data(row_elems):
+    # Mirrors pandas' odf reader: repeated cells/rows are expanded, empty cells
+    # and rows are only written when followed by content, then the table is squared.
+    data, empty_rows, max_row_len = [], 0, 0
+    for row in row_elems:
+        values, empty_cells = [], 0
+        for cell in row:
+            if cell.tag not in (_ODS_CELL, _ODS_COVERED_CELL):
+                continue
+            value = _ods_cell_value(cell) if cell.tag == _ODS_CELL else ""
+            repeat = int(cell.get(_TABLE_NS + "number-columns-repeated", 1))
+            if value == "":
+                empty_cells += repeat
+            else:
+                values.extend([""] * empty_cells)
+                empty_cells = 0
+                values.extend([value] * repeat)
+        max_row_len = max(max_row_len, len(values))
+        row_repeat = int(row.get(_TABLE_NS + "number-rows-repeated", 1))
+        if not values:
+            empty_rows += row_repeat
+        else:
+            data.extend([[""]] * empty_rows)
+            empty_rows = 0
+            data.extend(list(values) for _ in range(row_repeat))
+    for values in data:
+        if len(values) < max_row_len:
+            values.extend([""] * (max_row_len - len(values)))
+    return data
+
+
+def read_ods_sheet(file, sheet_name, nrows=None):
+    """One sheet of an ODS file as a DataFrame, equal to
+    pd.read_excel(file, sheet_name=sheet_name, engine='odf', nrows=nrows).
+    With nrows, parsing stops right after the rows needed."""
+    file.seek(0)
+    # header row + nrows; empty rows are rare in exports, TextParser trims any excess
+    row_limit = None if nrows is None else nrows + 1
+    with zipfile.ZipFile(file) as archive, archive.open("content.xml") as content:
+        for name, row_elems in _iter_ods_tables(content, wanted=sheet_name, row_limit=row_limit):
+            if name == sheet_name:
+                break
+        else:
+            raise ValueError(f"Planilha '{sheet_name}' não encontrada")
+    data = _ods_rows_to_data(row_elems)
+    if not data:
+        return pd.DataFrame()
+    try:
+        # The same text parsing read_excel applies to the raw cell values
+        return TextParser(data, header=0, skip_blank_lines=False, nrows=nrows).read(nrows)
+    except EmptyDataError:
+        return pd.DataFrame()
+
+
+def read_sheet(file, extension, sheet_name, nrows=None):
+    """Parses one sheet of an XLSX/ODS file (only its first nrows rows, if
+    given) without loading the other sheets."""
+    if extension == "ods":
+        return read_ods_sheet(file, sheet_name, nrows=nrows)
+    file.seek(0)
+    return pd.read_excel(file, sheet_name=sheet_name, engine="openpyxl", nrows=nrows)
+
+
+# Background parsing of the sheets that were not selected. One worker: this is
+# a convenience and should not compete with the sessions' foreground work.
+_prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheet-prefetch")
+_prefetching = {} # (content hash, sheet name) -> Future of the parsed DataFrame
+_prefetching_lock = threading.Lock()
+
+
+def _prefetch_one(data, content_hash, extension, sheet_name):
+    file = io.BytesIO(data)
+    df, _ = load_with_cache(file, sheet_name, lambda: read_sheet(file, extension, sheet_name),
+                            content_hash=content_hash)
+    return df
+
+
+def prefetch_sheets(file, extension, sheet_names, content_hash=None):
+    """Parses the given sheets in the background into the ingest cache.
+
+    The bytes are copied, so the uploaded file object can keep being used by
+    the session. Sheets already queued for the same file are not queued again.
+    """
+    content_hash = content_hash or file_content_hash(file)
+    data = file.getvalue()
+    with _prefetching_lock:
+        for sheet_name in sheet_names:
+            key = (content_hash, sheet_name)
+            if key not in _prefetching:
+                future = _prefetch_pool.submit(_prefetch_one, data, content_hash, extension, sheet_name)
+                future.add_done_callback(lambda f, key=key: _forget_prefetch(key))
+                _prefetching[key] = future
+
+
+def _forget_prefetch(key):
+    # Once parsed, the sheet is served by the ingest cache
+    with _prefetching_lock:
+        _prefetching.pop(key, None)
+
+
+def load_sheet(file, extension, sheet_name, content_hash=None):
+    """Returns (DataFrame, from_cache) for one sheet, going through the ingest
+    cache. If the sheet is being parsed in the background, waits for that parse
+    instead of starting a second one."""
+    content_hash = content_hash or file_content_hash(file)
+    with _prefetching_lock:
+        pending = _prefetching.get((content_hash, sheet_name))
+    if pending is not None:
+        try:
+            return pending.result(), True
+        except Exception:
+            pass # parse again below and surface the error to the user
+    return load_with_cache(file, sheet_name, lambda: read_sheet(file, extension, sheet_name),
+                           content_hash=content_hash)
@@ -1,6 +1,9 @@
 import streamlit as st
 import json
 
+from dataset_cache import get_column_catalog
+from dataset_registry import acquire_dataset
+
 SAVED_FILTERS_FILE = "named_filters.json" # Define here or pass as arg
 
 def initialize_session_state():
@@ -12,11 +15,48 @@ def initialize_session_state():
         st.session_state.df = None
     if 'selected_sheet' not in st.session_state:
         st.session_state.selected_sheet = None
+    if 'stream_source' not in st.session_state:
+        st.session_state.stream_source = None
+    if 'load_info' not in st.session_state:
+        st.session_state.load_info = None
+    if 'dataset_handle' not in st.session_state:
+        st.session_state.dataset_handle = None
     if "filter_set_name_save_input" not in st.session_state:
         st.session_state.filter_set_name_save_input = ""
     if "selected_filter_action" not in st.session_state:
         st.session_state.selected_filter_action = "--Selecione--"
 
+def set_session_dataframe(df, stream_source=None, load_info=None):
+    """Replaces st.session_state.df.
+
+    The DataFrame goes through the process-wide dataset registry: if another
+    session already loaded the same content, st.session_state.df becomes that
+    shared copy. The session only holds a handle to it; the previous dataset's
+    handle is released, which drops it (and its cached indexes) once no session
+    uses it any more.
+
+    For a streamed CSV, df is only a sample (first chunk) and stream_source
+    (see data_loading.make_stream_source) describes the full file. load_info
+    (see data_loading.measure_load) is shown next to the data summary.
+
+    The column catalog (dataset_cache.get_column_catalog) the filter widgets
+    read from is built here if the loader did not build it yet."""
+    previous_handle = st.session_state.get('dataset_handle')
+    nbytes = (load_info or {}).get('memory_after')
+    handle = acquire_dataset(df, nbytes=nbytes) if df is not None else None
+    if handle is not None:
+        get_column_catalog(handle.df) # once per dataset: already built if shared or loaded by _load_upload
+    if previous_handle is not None:
+        previous_handle.release()
+    st.session_state.dataset_handle = handle
+    st.session_state.df = handle.df if handle is not None else None
+    st.session_state.stream_source = stream_source
+    st.session_state.load_info = load_info
+    st.session_state.pop('stream_result', None)
+    superseded_job = st.session_state.pop('ingest_job', None)
+    if superseded_job is not None:
+        superseded_job.cancel() # a background parse still running is superseded
+
 def load_all_filter_sets():
     try:
         with open(SAVED_FILTERS_FILE, "r") as f:
@@ -1,12 +1,37 @@
+import os
+import time
+
 import streamlit as st
-import pandas as pd
 
 from state_helpers import (
     load_all_filter_sets,
     save_named_filter_set,
     load_named_filter_set,
-    delete_named_filter_set
+    delete_named_filter_set,
+    set_session_dataframe
+)
+from dataset_cache import get_column_catalog, get_content_hash, get_value_search_index
+from data_loading import (
+    CSV_READ_OPTIONS,
+    list_server_csv_files,
+    make_stream_source,
+    measure_load,
+    read_csv_fast,
+    read_csv_preview,
+    read_stream_sample,
+    stream_filter_csv
 )
+from filter_plan import canonical_filters_json
+from ingest_cache import file_content_hash, is_cached, load_with_cache
+from background_ingest import BACKGROUND_MIN_BYTES, PREVIEW_ROWS, IngestJob, ProgressFile
+from dtype_compaction import compact_dtypes
+from multi_file_loading import load_files_parallel
+from result_export import EXPORT_FORMATS, ExportFile, export_rows
+from result_grid import PAGE_SIZES, grid_page, sort_positions
+from spreadsheet_loading import list_sheet_names, load_sheet, prefetch_sheets, read_sheet
+
+# Text columns with more distinct values than this get a searchable, paged value picker
+VALUE_PICKER_PAGE_SIZE = 100
 
 def display_file_uploader(uploader_key: str = "default_file_uploader_widget"):
     """Displays the file uploader and handles file processing for XLSX, CSV, and ODS.
@@ -24,11 +49,20 @@ def display_file_uploader(uploader_key: str = "default_file_uploader_widget"):
         st.session_state.selected_sheet = None
     # 'df' and 'filters' should be initialized by initialize_session_state() in app.py
 
-    uploaded_file = st.file_uploader(
-        "Escolha um arquivo (XLSX, CSV, ODS)", 
+    uploaded_files = st.file_uploader(
+        "Escolha um ou mais arquivos (XLSX, CSV, ODS)", 
         type=["xlsx", "csv", "ods"], 
-        key=uploader_key
+        key=uploader_key,
+        accept_multiple_files=True,
+        help="Vários arquivos (ex.: um por liga ou temporada) são lidos em paralelo e combinados em um único conjunto de dados."
     )
+    ingest_error = st.session_state.pop('ingest_error', None)
+    if ingest_error:
+        st.error(ingest_error)
+    if len(uploaded_files) > 1:
+        _load_multiple_uploads(uploaded_files, uploader_key)
+        return
+    uploaded_file = uploaded_files[0] if uploaded_files else None
 
     if uploaded_file is not None:
         file_extension = uploaded_file.name.split('.')[-1].lower()
@@ -38,70 +72,82 @@ def display_file_uploader(uploader_key: str = "default_file_uploader_widget"):
         # The core idea is, if the file object itself is new, or its name is new, reset.
         if st.session_state.get(f"{uploader_key}_processed_file_name") != uploaded_file.name:
             st.session_state.uploaded_file_name = uploaded_file.name # Shared state for file name
-            st.session_state.df = None            # Shared DataFrame
+            set_session_dataframe(None)            # Shared DataFrame
             st.session_state.filters = []          # Shared active filters
             st.session_state.selected_sheet = None # Shared sheet selection
             st.session_state[f"{uploader_key}_processed_file_name"] = uploaded_file.name # Mark this uploader instance has processed this file name
 
         try:
             df_to_load = None
+            stream_source = None
+            load_info = None
+            ingest_job = None
             sheet_selection_key_base = f"{uploader_key}_sheet_selector"
 
-            if file_extension == "xlsx":
-                xls = pd.ExcelFile(uploaded_file)
-                sheet_names = xls.sheet_names
-                
+            if file_extension in ("xlsx", "ods"):
+                # Sheet names come from the workbook metadata; nothing else is parsed until a sheet is loaded
+                sheet_names = _get_sheet_names(uploaded_file, file_extension, uploader_key)
+
                 if len(sheet_names) > 1:
                     current_sheet_index = 0
-                    # Use a more specific session state key for the selected sheet if needed, e.g., tied to uploader_key
                     # For now, st.session_state.selected_sheet is global.
                     if st.session_state.selected_sheet and st.session_state.selected_sheet in sheet_names:
                         current_sheet_index = sheet_names.index(st.session_state.selected_sheet)
-                    
-                    selected_sheet_name_key = f"{sheet_selection_key_base}_xlsx"
+
+                    selected_sheet_name_key = f"{sheet_selection_key_base}_{file_extension}"
                     selected_sheet_name = st.selectbox(
-                        "Escolha uma planilha (XLSX)", 
-                        sheet_names, 
-                        index=current_sheet_index, 
+                        f"Escolha uma planilha ({file_extension.upper()})",
+                        sheet_names,
+                        index=current_sheet_index,
                         key=selected_sheet_name_key
                     )
+                    prefetch_others = st.checkbox(
+                        "Pré-carregar as outras planilhas em segundo plano", key=f"{uploader_key}_prefetch_sheets",
+                        help="As demais planilhas são lidas em segundo plano, tornando a troca de planilha instantânea."
+                    )
                 else:
                     selected_sheet_name = sheet_names[0]
+                    prefetch_others = False
 
                 if st.session_state.selected_sheet != selected_sheet_name or st.session_state.df is None:
                     st.session_state.selected_sheet = selected_sheet_name
-                    df_to_load = pd.read_excel(xls, sheet_name=selected_sheet_name)
-
-            elif file_extension == "ods":
-                xls = pd.ExcelFile(uploaded_file, engine='odf')
-                sheet_names = xls.sheet_names
+                    engine = 'openpyxl' if file_extension == "xlsx" else 'odf (streaming)'
+                    background = _start_background_load(uploaded_file, file_extension, selected_sheet_name, engine)
+                    if background is not None:
+                        df_to_load, load_info, ingest_job = background
+                    else:
+                        df_to_load, load_info = _load_upload(
+                            engine, lambda info: load_sheet(uploaded_file, file_extension, selected_sheet_name))
+
+                prefetch_marker = f"{uploader_key}_prefetched_file"
+                if prefetch_others and st.session_state.get(prefetch_marker) != _file_identity(uploaded_file):
+                    prefetch_sheets(uploaded_file, file_extension, [s for s in sheet_names if s != selected_sheet_name])
+                    st.session_state[prefetch_marker] = _file_identity(uploaded_file)
 
-                if len(sheet_names) > 1:
-                    current_sheet_index = 0
-                    if st.session_state.selected_sheet and st.session_state.selected_sheet in sheet_names:
-                        current_sheet_index = sheet_names.index(st.session_state.selected_sheet)
-                    
-                    selected_sheet_name_key = f"{sheet_selection_key_base}_ods"
-                    selected_sheet_name = st.selectbox(
-                        "Escolha uma planilha (ODS)", 
-                        sheet_names, 
-                        index=current_sheet_index, 
-                        key=selected_sheet_name_key
-                    )
-                else:
-                    selected_sheet_name = sheet_names[0]
-                
-                if st.session_state.selected_sheet != selected_sheet_name or st.session_state.df is None:
-                    st.session_state.selected_sheet = selected_sheet_name
-                    df_to_load = pd.read_excel(xls, sheet_name=selected_sheet_name, engine='odf')
-            
             elif file_extension == "csv":
                 st.session_state.selected_sheet = None 
-                if st.session_state.df is None or st.session_state.uploaded_file_name != uploaded_file.name : # simplified condition for CSV
-                    df_to_load = pd.read_csv(uploaded_file)
+                stream_mode = st.toggle(
+                    "Modo streaming (CSV maior que a memória)", key=f"{uploader_key}_stream_mode",
+                    help="O arquivo é lido em blocos a cada filtragem e só as linhas filtradas ficam em memória."
+                )
+                is_streamed = st.session_state.get('stream_source') is not None
+                if st.session_state.df is None or st.session_state.uploaded_file_name != uploaded_file.name or stream_mode != is_streamed: # simplified condition for CSV
+                    if stream_mode:
+                        stream_source = make_stream_source(uploaded_file)
+                        df_to_load = read_stream_sample(stream_source)
+                    else:
+                        background = _start_background_load(uploaded_file, file_extension, None, 'pandas')
+                        if background is not None:
+                            df_to_load, load_info, ingest_job = background
+                        else:
+                            df_to_load, load_info = _load_upload('pandas', lambda info: load_with_cache(
+                                uploaded_file, None, lambda: read_csv_fast(uploaded_file, info),
+                                read_options=CSV_READ_OPTIONS))
             
             if df_to_load is not None:
-                st.session_state.df = df_to_load
+                set_session_dataframe(df_to_load, stream_source=stream_source, load_info=load_info)
+                if ingest_job is not None: # df_to_load is only a preview
+                    st.session_state.ingest_job = ingest_job
                 # Reset filters when a new DataFrame is loaded to avoid applying old filters to new data structure
                 st.session_state.filters = [] 
                 st.rerun()
@@ -109,22 +155,351 @@ def display_file_uploader(uploader_key: str = "default_file_uploader_widget"):
         except Exception as e:
             st.error(f"Erro ao processar o arquivo ({uploaded_file.name}): {e}")
             st.session_state.uploaded_file_name = None
-            st.session_state.df = None
+            set_session_dataframe(None)
             st.session_state.filters = []
             st.session_state.selected_sheet = None
             st.session_state.pop(f"{uploader_key}_processed_file_name", None) # Clear processed file marker
             st.rerun()
 
+        if st.session_state.get('ingest_job') is not None:
+            display_ingest_progress()
+
+    elif uploaded_file is None and list_server_csv_files() and _display_server_csv_picker(uploader_key):
+        pass # a server-side CSV is being streamed
+
     elif st.session_state.uploaded_file_name is not None and uploaded_file is None: 
         # This condition means a file was previously uploaded but now the uploader is empty (user removed it)
         st.session_state.uploaded_file_name = None
-        st.session_state.df = None
+        set_session_dataframe(None)
         st.session_state.filters = []
         st.session_state.selected_sheet = None
         st.session_state.pop(f"{uploader_key}_processed_file_name", None) # Clear processed file marker
         st.rerun()
 
 
+def _start_background_load(uploaded_file, file_extension, sheet_name, engine):
+    """Starts parsing a large upload on a background worker.
+
+    Returns (preview DataFrame, preview load_info, IngestJob), or None when the
+    upload is small or already in the Parquet cache and should just be loaded.
+    """
+    if uploaded_file.size < BACKGROUND_MIN_BYTES:
+        return None
+    content_hash = file_content_hash(uploaded_file)
+    if is_cached(content_hash, sheet_name, CSV_READ_OPTIONS if sheet_name is None else None):
+        return None
+
+    if sheet_name is None:
+        read_preview = lambda info: (read_csv_preview(uploaded_file, PREVIEW_ROWS), False)
+    else:
+        read_preview = lambda info: (read_sheet(uploaded_file, file_extension, sheet_name, nrows=PREVIEW_ROWS), False)
+    # Same post-processing as the full load (compaction, catalog), so the dtypes
+    # the filters see do not change when the full dataset replaces the preview
+    preview, preview_info = _load_upload(engine, read_preview)
+    preview_info['preview_rows'] = len(preview)
+    # The worker parses its own copy: the session keeps using uploaded_file
+    progress_file = ProgressFile(uploaded_file.getvalue(), uploaded_file.name)
+    if sheet_name is None:
+        def parse_csv(info):
+            df = read_csv_fast(progress_file, info)
+            progress_file.raise_if_cancelled() # a read cut short must not reach the ingest cache
+            return df
+
+        def load_full(info):
+            return load_with_cache(progress_file, None, lambda: parse_csv(info),
+                                   content_hash=content_hash, read_options=CSV_READ_OPTIONS)
+    else:
+        def load_full(info):
+            return load_sheet(progress_file, file_extension, sheet_name, content_hash=content_hash)
+    job = IngestJob(uploaded_file.name, lambda: _load_upload(engine, load_full), progress_file)
+    return preview, preview_info, job
+
+
+@st.fragment(run_every=1.0)
+def display_ingest_progress():
+    """Progress of the background parse; swaps the full dataset in when done.
+    Runs as a fragment every second, so only this part of the page reruns."""
+    job = st.session_state.get('ingest_job')
+    if job is None:
+        return
+    if not job.done:
+        st.progress(job.progress, text=f"⏳ Carregando `{job.name}` em segundo plano ({job.elapsed:.0f}s)... "
+                                       f"Os filtros já podem ser configurados na prévia.")
+        return
+    try:
+        df_full, load_info = job.result()
+    except Exception as e:
+        st.session_state.ingest_error = f"Erro ao processar o arquivo ({job.name}): {e}"
+        st.session_state.uploaded_file_name = None
+        set_session_dataframe(None)
+        st.session_state.filters = []
+    else:
+        # Filters configured on the preview are kept: same columns, now on every row
+        set_session_dataframe(df_full, load_info=load_info)
+    st.rerun()
+
+
+def _load_multiple_uploads(uploaded_files, uploader_key):
+    """Combines several uploads (first sheet of each workbook) into one dataset,
+    parsing them concurrently; see multi_file_loading.load_files_parallel."""
+    combined_name = " + ".join(f.name for f in uploaded_files)
+    marker_key = f"{uploader_key}_processed_file_name"
+    if st.session_state.get(marker_key) == combined_name and st.session_state.df is not None:
+        return
+    # A failed combination is remembered for these exact uploads, so reruns show
+    # the error again instead of parsing every file again
+    failure_key = f"{uploader_key}_failed_uploads"
+    signature = tuple(_file_identity(f) for f in uploaded_files)
+    failure = st.session_state.get(failure_key)
+    if failure is not None and failure[0] == signature:
+        st.error(failure[1])
+        return
+    try:
+        def load(info):
+            df, multi_info = load_files_parallel(uploaded_files)
+            info.update(multi_info)
+            return df, False
+        with st.spinner(f"Lendo {len(uploaded_files)} arquivos em paralelo..."):
+            df_to_load, load_info = _load_upload(None, load)
+    except Exception as e:
+        message = f"Erro ao combinar os arquivos ({combined_name}): {e}"
+        st.session_state[failure_key] = (signature, message)
+        st.error(message)
+        st.session_state.uploaded_file_name = None
+        set_session_dataframe(None)
+        st.session_state.filters = []
+        st.session_state.selected_sheet = None
+        return
+    st.session_state[marker_key] = combined_name
+    st.session_state.pop(failure_key, None)
+    st.session_state.uploaded_file_name = combined_name
+    st.session_state.selected_sheet = None
+    set_session_dataframe(df_to_load, load_info=load_info)
+    st.session_state.filters = []
+    st.rerun()
+
+
+def _load_upload(engine, load):
+    """Times load(info) -> (df, from_cache), a load through the Parquet ingest
+    cache, then compacts the dtypes and builds the column catalog. Returns (df,
+    load_info) with the engine that produced the data, the memory before/after
+    compaction and the time spent on the catalog."""
+    def timed_load(info):
+        df, from_cache = load(info)
+        info['engine'] = 'cache parquet' if from_cache else info.get('engine', engine)
+        return df
+    df, load_info = measure_load(timed_load)
+    df, compaction = compact_dtypes(df)
+    load_info.update(memory_before=compaction['memory_before'], memory_after=compaction['memory_after'],
+                     converted_columns=compaction['converted'])
+    # Here rather than in set_session_dataframe, so that background loads build it on the worker
+    started = time.perf_counter()
+    get_column_catalog(df)
+    load_info['catalog_seconds'] = time.perf_counter() - started
+    return df, load_info
+
+
+def _file_identity(uploaded_file):
+    # Streamlit gives every upload a new file_id, even for the same file name
+    return getattr(uploaded_file, 'file_id', None) or uploaded_file.name
+
+
+def _get_sheet_names(uploaded_file, file_extension, uploader_key):
+    """Sheet names of the uploaded workbook, read once per upload."""
+    names_key = f"{uploader_key}_sheet_names"
+    cached = st.session_state.get(names_key)
+    if cached is not None and cached[0] == _file_identity(uploaded_file):
+        return cached[1]
+    sheet_names = list_sheet_names(uploaded_file, file_extension)
+    if not sheet_names:
+        raise ValueError("nenhuma planilha encontrada no arquivo")
+    st.session_state[names_key] = (_file_identity(uploaded_file), sheet_names)
+    return sheet_names
+
+
+def _display_server_csv_picker(uploader_key):
+    """Lets the user stream a CSV from STREAM_DATA_DIR (files too large to upload).
+    Returns True while a server-side file is selected."""
+    options = ["--Nenhum--"] + list_server_csv_files()
+    choice = st.selectbox("Ou use um CSV do servidor (modo streaming)", options, key=f"{uploader_key}_server_csv")
+    if choice == "--Nenhum--":
+        return False
+    if st.session_state.uploaded_file_name != choice or st.session_state.get('stream_source') is None:
+        stream_source = make_stream_source(choice)
+        try:
+            sample_df = read_stream_sample(stream_source)
+        except Exception as e:
+            st.error(f"Erro ao processar o arquivo ({choice}): {e}")
+            return False
+        st.session_state.uploaded_file_name = choice
+        st.session_state.selected_sheet = None
+        st.session_state.filters = []
+        set_session_dataframe(sample_df, stream_source=stream_source)
+        st.rerun()
+    return True
+
+
+def run_streamed_filters(stream_source, active_filters):
+    """Filters the streamed CSV with a progress bar. The result is kept in
+    st.session_state until the filters or the source change, so unrelated
+    reruns do not re-read the file."""
+    result_key = (stream_source['name'], canonical_filters_json(active_filters))
+    cached = st.session_state.get('stream_result')
+    if cached is not None and cached[0] == result_key:
+        result, messages = cached[1], cached[2]
+    else:
+        progress_bar = st.progress(0.0, text="Lendo o arquivo em blocos...")
+        messages = []
+        result = stream_filter_csv(stream_source, active_filters, messages,
+                                   progress=make_stream_progress(progress_bar))
+        progress_bar.empty()
+        st.session_state.stream_result = (result_key, result, messages)
+    for level, text in messages:
+        (st.error if level == 'error' else st.warning)(text)
+    return result
+
+
+def display_result_grid(df, positions, active_filters):
+    """Shows the rows of df at positions (the filter result) one page at a time,
+    with column selection and sorting done on the server: only the current page
+    is sent to the browser. Returns (positions in display order, shown columns)."""
+    columns = list(dict.fromkeys(df.columns))
+    if st.session_state.get('grid_columns_of') != columns: # new dataset: reset the grid controls
+        for key in ('grid_columns', 'grid_sort_column', 'grid_page'):
+            st.session_state.pop(key, None)
+        st.session_state.grid_columns_of = columns
+
+    c_cols, c_sort, c_desc, c_size = st.columns([4, 2, 1, 1])
+    with c_cols:
+        shown_columns = st.multiselect("Colunas exibidas", columns, default=columns, key="grid_columns")
+    with c_sort:
+        no_sort = "(ordem original)"
+        sort_column = st.selectbox("Ordenar por", [no_sort] + columns, key="grid_sort_column")
+    with c_desc:
+        descending = st.checkbox("Decrescente", key="grid_sort_desc")
+    with c_size:
+        page_size = st.selectbox("Linhas por página", PAGE_SIZES, index=1, key="grid_page_size")
+
+    if sort_column != no_sort:
+        # Sorted positions are kept until the result or the sort changes, so paging does not re-sort
+        sort_key = (get_content_hash(df) or id(df), canonical_filters_json(active_filters), len(positions),
+                    sort_column, descending)
+        cached = st.session_state.get('grid_sorted')
+        if cached is not None and cached[0] == sort_key:
+            positions = cached[1]
+        else:
+            positions = sort_positions(df, positions, sort_column, ascending=not descending)
+            st.session_state.grid_sorted = (sort_key, positions)
+
+    n_rows = len(positions)
+    n_pages = max(1, -(-n_rows // page_size))
+    filters_json = canonical_filters_json(active_filters)
+    if st.session_state.get('grid_filters_of') != filters_json: # new result: back to the first page
+        st.session_state.grid_filters_of = filters_json
+        st.session_state.grid_page = 1
+    elif st.session_state.get('grid_page', 1) > n_pages:
+        st.session_state.grid_page = n_pages
+    page = st.session_state.get('grid_page', 1)
+    first = (page - 1) * page_size
+    st.dataframe(grid_page(df, positions, page, page_size, shown_columns or None),
+                 height=300, use_container_width=True)
+
+    c_info, c_page = st.columns([6, 2])
+    with c_page:
+        st.number_input(f"Página (de {n_pages})", min_value=1, max_value=n_pages, step=1, key="grid_page")
+    with c_info:
+        st.caption(f"Linhas {min(first + 1, n_rows)}–{min(first + page_size, n_rows)} de {n_rows}")
+    return positions, shown_columns or columns
+
+
+def _release_export(export_key):
+    export = st.session_state.pop(export_key, None)
+    if export is not None:
+        export.release()
+
+
+def display_export_controls(df, positions, result_key, key, file_stem, columns=None):
+    """Export of the rows of df at positions (in that order) to a file, written
+    in chunks with a progress bar, then offered for download.
+
+    The file is only prepared on request and offered while result_key (e.g. the
+    filters) and the other options still match; it is deleted once downloaded,
+    when the result changes or when the session ends. key prefixes the widget keys.
+    """
+    export_key = f"{key}_export"
+    c_format, c_button, c_download = st.columns([2, 2, 3])
+    with c_format:
+        export_format = st.selectbox("Formato", list(EXPORT_FORMATS), key=f"{key}_export_format",
+                                     label_visibility="collapsed")
+    extension, mime = EXPORT_FORMATS[export_format]
+    signature = (get_content_hash(df) or id(df), result_key, export_format, len(positions), tuple(columns or ()))
+    with c_button:
+        prepare = st.button(f"📥 Preparar arquivo ({len(positions)} linhas)", key=f"{key}_export_button")
+    if prepare:
+        _release_export(export_key)
+        export = ExportFile(extension, f"{file_stem}.{extension}", mime, signature)
+        progress_bar = st.progress(0.0, text="Exportando...")
+        def report_progress(rows_written, fraction):
+            progress_bar.progress(fraction, text=f"Linhas exportadas: {rows_written:,}".replace(",", "."))
+        try:
+            export_rows(df, positions, export_format, export.path, columns=columns, progress=report_progress)
+        except Exception as e:
+            export.release()
+            st.error(f"Erro ao exportar ({export_format}): {e}")
+        else:
+            st.session_state[export_key] = export
+        progress_bar.empty()
+
+    export = st.session_state.get(export_key)
+    if export is None:
+        return
+    if export.signature != signature or not os.path.exists(export.path):
+        _release_export(export_key) # stale: the result or the options changed
+        return
+    # download_button reads the whole file on every rerun it is shown in, so it
+    # is only shown from preparation until the download
+    with c_download, open(export.path, 'rb') as exported_file:
+        st.download_button(f"⬇️ Baixar {export.file_name}", exported_file, file_name=export.file_name,
+                           mime=export.mime, key=f"{key}_export_download",
+                           on_click=_release_export, args=(export_key,))
+
+
+def make_stream_progress(progress_bar):
+    """Progress callback for the streaming functions of data_loading."""
+    def report_progress(rows_read, fraction):
+        progress_bar.progress(fraction, text=f"Linhas lidas: {rows_read:,}".replace(",", "."))
+    return report_progress
+
+
+def _display_value_picker(df, column, current_value, i):
+    """Value selectbox for high-cardinality text columns: only one page of
+    VALUE_PICKER_PAGE_SIZE values is sent to the browser, the most frequent
+    first, or those starting with the searched text. Returns the chosen value."""
+    index = get_value_search_index(df, column)
+    search = st.text_input("Buscar valor", key=f"cv_val_search_{i}", label_visibility="collapsed",
+                           placeholder=f"🔎 Buscar entre {len(index)} valores")
+    page_key, search_key = f"cv_val_page_{i}", f"cv_val_last_search_{i}"
+    if st.session_state.get(search_key) != search: # new search: back to the first page
+        st.session_state[search_key] = search
+        st.session_state[page_key] = 1
+    page = int(st.session_state.get(page_key, 1))
+    values, counts, total = index.page(search, (page - 1) * VALUE_PICKER_PAGE_SIZE, VALUE_PICKER_PAGE_SIZE)
+    n_pages = max(1, -(-total // VALUE_PICKER_PAGE_SIZE))
+
+    count_of = dict(zip(values, counts))
+    # The stored value stays selectable when it is not on the current page
+    options = [''] + ([current_value] if current_value and current_value not in count_of else []) + values
+    chosen = st.selectbox("Valor", options, index=options.index(current_value) if current_value in options else 0,
+                          key=f"cv_val_cat_val_{i}", label_visibility="collapsed",
+                          format_func=lambda v: f"{v} ({count_of[v]})" if v in count_of else v)
+    if total == 0:
+        st.caption("Nenhum valor encontrado.")
+    elif n_pages > 1:
+        st.number_input(f"Página (de {n_pages}, {total} valores)", min_value=1, max_value=n_pages,
+                        key=page_key, step=1)
+    return chosen
+
+
 def display_filter_controls_in_main(df_columns):
     """ Renders filter configuration controls in the main application area. """
     st.markdown("---")
@@ -147,6 +522,10 @@ def display_filter_controls_in_main(df_columns):
         st.info("Nenhum filtro adicionado.")
         return # No need to iterate if no filters
 
+    # Built once per dataset at load time: widgets below never scan the rows
+    catalog = get_column_catalog(st.session_state.df) if st.session_state.get('df') is not None else {}
+    num_cols = [c for c in df_columns if c in catalog and catalog[c].is_numeric]
+
     for i, f_config in enumerate(st.session_state.filters):
         filter_type_display = f_config.get('type_display_name', 'Filtro Desconhecido')
         
@@ -196,7 +575,7 @@ def display_filter_controls_in_main(df_columns):
                     if new_type == 'column_value':
                         f_config.update({'column': df_columns[0] if df_columns else None, 'value': '', 'condition': '=='})
                     elif new_type == 'column_range':
-                         f_config.update({'column': (df_columns[0] if df_columns and st.session_state.df is not None and any(pd.api.types.is_numeric_dtype(st.session_state.df[c].dtype) for c in df_columns if c in st.session_state.df.columns) else None), 
+                         f_config.update({'column': (df_columns[0] if df_columns and num_cols else None), 
                                           'value': [0,0], 'condition': '=='}) # Default range e.g. [min, max] from data later
                     elif new_type == 'column_comparison':
                         f_config.update({
@@ -222,9 +601,9 @@ def display_filter_controls_in_main(df_columns):
                 with cc_val[0]:
                     f_config['column'] = st.selectbox("Coluna", df_columns, index=idx_val, key=f"cv_col_val_{i}", label_visibility="collapsed")
                 
-                if f_config['column'] and f_config['column'] in st.session_state.df.columns:
-                    dtype = st.session_state.df[f_config['column']].dtype
-                    if pd.api.types.is_numeric_dtype(dtype):
+                if f_config['column'] and f_config['column'] in catalog:
+                    profile = catalog[f_config['column']]
+                    if profile.is_numeric:
                         conds = ['==', '!=', '>', '<', '>=', '<=']
                         with cc_val[1]:
                             c_idx = conds.index(f_config.get('condition','==')) if f_config.get('condition','==') in conds else 0
@@ -249,10 +628,15 @@ def display_filter_controls_in_main(df_columns):
                             c_idx = conds.index(f_config.get('condition','==')) if f_config.get('condition','==') in conds else 0
                             f_config['condition'] = st.selectbox("Cond.", conds, index=c_idx, key=f"cv_cond_cat_val_{i}", label_visibility="collapsed")
                         with cc_val[2]:
-                            u_vals = [''] + sorted(list(st.session_state.df[f_config['column']].astype(str).unique()))
-                            s_val = str(f_config.get('value', ''))
-                            v_idx = u_vals.index(s_val) if s_val in u_vals else 0
-                            f_config['value'] = st.selectbox("Valor", u_vals, index=v_idx, key=f"cv_val_cat_val_{i}", label_visibility="collapsed")
+                            stored_value = f_config.get('value')
+                            # None (new filter) and '' both mean "no value chosen yet"
+                            s_val = '' if stored_value is None else str(stored_value)
+                            if profile.distinct_count <= VALUE_PICKER_PAGE_SIZE:
+                                u_vals = [''] + profile.options
+                                v_idx = u_vals.index(s_val) if s_val in u_vals else 0
+                                f_config['value'] = st.selectbox("Valor", u_vals, index=v_idx, key=f"cv_val_cat_val_{i}", label_visibility="collapsed")
+                            else:
+                                f_config['value'] = _display_value_picker(st.session_state.df, f_config['column'], s_val, i)
                 else:
                      with cc_val[1]: st.empty() # Keep layout consistent
                      with cc_val[2]: st.empty()
@@ -260,8 +644,6 @@ def display_filter_controls_in_main(df_columns):
 
             elif f_config['type'] == 'column_range':
                 cr_cols_rng = st.columns([1,2])
-                num_cols = [c for c in df_columns if c in st.session_state.df.columns and pd.api.types.is_numeric_dtype(st.session_state.df[c].dtype)]
-                
                 current_col_rng = f_config.get('column')
                 if not num_cols: 
                     with cr_cols_rng[0]: st.warning("Nenhuma coluna numérica disponível."); f_config['column'] = None
@@ -275,10 +657,10 @@ def display_filter_controls_in_main(df_columns):
                     with cr_cols_rng[0]:
                         f_config['column'] = st.selectbox("Coluna Num.", num_cols, index=idx_rng, key=f"cr_col_rng_{i}", label_visibility="collapsed")
                     
-                    if f_config['column'] and f_config['column'] in st.session_state.df.columns: # Ensure column still exists
+                    if f_config['column'] and f_config['column'] in catalog: # Ensure column still exists
                         with cr_cols_rng[1]:
-                            num_series = pd.to_numeric(st.session_state.df[f_config['column']], errors='coerce').dropna()
-                            d_min, d_max = (float(num_series.min()), float(num_series.max())) if not num_series.empty else (0.0, 0.1)
+                            profile = catalog[f_config['column']]
+                            d_min, d_max = (profile.min, profile.max) if profile.null_count < profile.n_rows else (0.0, 0.1)
                             if d_min >= d_max: d_max = d_min + (0.1 if d_min == 0 else abs(d_min * 0.1) or 0.1) # Ensure max > min
                             
                             # Ensure 'value' for range is a list of two numbers